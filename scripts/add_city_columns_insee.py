@@ -1,10 +1,15 @@
+import contextlib
+import os
 import pandas as pd
-import time
-import requests
+import numpy as np
+from sklearn.neighbors import BallTree
+from scripts.config import PATH_COMMUNES, RENAME_COMMUNES
+from scripts.geocode_cache import GeocodeCache
+from scripts.geocoding_client import GeocodingClient
 
-GOV_API = "https://api-adresse.data.gouv.fr/reverse"
-HEADERS = {"User-Agent": "geodair-geocoder"}
-SLEEP_SEC = 0.12
+EARTH_RADIUS_KM = 6371.0
+MAX_DIST_KM = 10.0
+PLM_ARRONDISSEMENTS = r"^(751\d\d|6938\d|132\d\d)$"
 
 
 def reverse_insee(lat, lon, timeout=10):
@@ -12,45 +17,141 @@ def reverse_insee(lat, lon, timeout=10):
     """
     Prend en argument une latitude et une longitude,
     et retourne la commune où se trouve ces coordonnées, ainsi que son code commune INSEE,
-    en interrogeant l'API de data.gouv.fr.
+    en interrogeant l'API de data.gouv.fr (un seul point : cf. GeocodingClient pour en traiter plusieurs).
     """
 
-    params = {"lat": lat, "lon": lon}
-    try:
-        r = requests.get(GOV_API, params=params, headers=HEADERS, timeout=timeout)
-        r.raise_for_status()
-        data = r.json()
-        feats = data.get("features", [])
-        if not feats:
-            return None, None
+    with GeocodingClient(timeout=timeout) as client:
+        return client.reverse(lat, lon)
 
-        props = feats[0].get("properties", {})
-        city = props.get("city")
-        code_insee = props.get("citycode")
 
-        return city, code_insee
+def load_communes_reference(path_communes=PATH_COMMUNES):
+
+    """
+    Charge le référentiel des communes (une ligne par code INSEE)
+    avec les colonnes 'CODGEO', 'Ville', 'Latitude_commune' et 'Longitude_commune'.
+    'Ville' (nom_commune_complet, avec article) reprend le libellé du champ city de l'API de géocodage.
+    """
+
+    communes = pd.read_csv(path_communes, usecols=list(RENAME_COMMUNES), dtype={"code_commune_INSEE": str})
+    communes = communes.rename(columns=RENAME_COMMUNES)
+    # Même libellé que le champ city de l'API : commune mère pour les arrondissements de Paris, Lyon et Marseille
+    plm = communes["CODGEO"].str.match(PLM_ARRONDISSEMENTS, na=False)
+    communes.loc[plm, "Ville"] = communes.loc[plm, "Ville"].str.extract(r"^(Paris|Lyon|Marseille)", expand=False)
+    communes = communes.dropna(subset=["Latitude_commune", "Longitude_commune"])
+    communes = communes.drop_duplicates(subset=["CODGEO"]).reset_index(drop=True)
+
+    return communes
+
+
+def build_commune_index(communes):
+
+    """
+    Construit un index spatial (BallTree, distance haversine) sur les coordonnées des communes.
+    """
+
+    coords = np.radians(communes[["Latitude_commune", "Longitude_commune"]].to_numpy(dtype=float))
+    return BallTree(coords, metric="haversine")
 
-    except Exception:
-        return None, None
 
+def reverse_insee_offline(lats, lons, communes, index=None, max_dist_km=MAX_DIST_KM):
 
-def add_city_codes(geodair):
+    """
+    Version hors-ligne et vectorisée de reverse_insee : associe à chaque point la commune
+    dont le centre est le plus proche, en une seule requête sur l'index spatial.
+    Retourne deux tableaux (villes, codes INSEE), à None pour les points situés
+    à plus de max_dist_km de toute commune du référentiel.
+    Approximation : le référentiel ne contient que le centre de chaque commune, pas ses contours;
+    une station proche d'une limite peut être rattachée à la commune voisine, alors que l'API
+    retourne la commune qui la contient (taux d'accord : cf. benchmark.check_offline_parity).
+    """
+
+    if index is None:
+        index = build_commune_index(communes)
+
+    points = np.radians(np.column_stack([np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)]))
+    dist, idx = index.query(points, k=1)
+    dist_km = dist[:, 0] * EARTH_RADIUS_KM
+    idx = idx[:, 0]
+
+    found = dist_km <= max_dist_km
+    cities = np.where(found, communes["Ville"].to_numpy(dtype=object)[idx], None)
+    codes = np.where(found, communes["CODGEO"].to_numpy(dtype=object)[idx], None)
+
+    return cities, codes
+
+
+def add_city_codes(geodair, path_communes=PATH_COMMUNES, fallback_api=True, cache=None, client=None, bulk=False,
+                   offline=False):
 
     """
     Ajoute au dataframe geodair une colonne 'Ville' et une colonne 'CODGEO'
     contenant respectivement la ville où se situe chaque station et son code commune INSEE.
+    Par défaut, les stations sont géocodées par l'API de data.gouv.fr (commune contenant la station),
+    en parallèle via un GeocodingClient (bulk=True pour passer par l'endpoint CSV).
+    offline=True : géocodage approché par le centre de commune le plus proche du référentiel path_communes
+    (cf. reverse_insee_offline), l'API n'étant interrogée que pour les points hors de l'index (si fallback_api).
+    Les réponses de l'API sont conservées d'une exécution à l'autre dans cache (GeocodeCache; par défaut,
+    celui de data/cache/geocode_cache.sqlite; cache=False pour interroger l'API à chaque fois).
     """
 
     coords_unique = geodair[['Latitude', 'Longitude']].drop_duplicates()
-    result = {}
-
-    for idx, row in coords_unique.iterrows():
-        lat, lon = row['Latitude'], row['Longitude']
-        city, code_insee = reverse_insee(lat, lon)
+    lats = coords_unique['Latitude'].to_numpy()
+    lons = coords_unique['Longitude'].to_numpy()
+
+    if offline:
+        if not os.path.exists(path_communes):
+            raise FileNotFoundError(f"Le géocodage hors-ligne nécessite le référentiel des communes "
+                                    f"{path_communes}")
+        communes = load_communes_reference(path_communes)
+        cities, codes = reverse_insee_offline(lats, lons, communes)
+    else:
+        cities = np.full(len(lats), None, dtype=object)
+        codes = np.full(len(lats), None, dtype=object)
+
+    if fallback_api:
+        with contextlib.ExitStack() as stack:
+            if cache is None:
+                cache = stack.enter_context(GeocodeCache())
+            elif cache is False:
+                cache = None
+
+            # Points hors de l'index : d'abord le cache, puis l'API pour les seuls points manquants
+            to_query = []
+            for i in np.flatnonzero(pd.isna(codes)):
+                cached = cache.get(lats[i], lons[i]) if cache is not None else None
+                if cached is not None:
+                    cities[i], codes[i] = cached
+                else:
+                    to_query.append(i)
+
+            if to_query:
+                coords = [(lats[i], lons[i]) for i in to_query]
+                if client is None:
+                    client = stack.enter_context(GeocodingClient())
+                answers = client.reverse_csv(coords) if bulk else client.reverse_many(coords)
+
+                for i, (city, code_insee) in zip(to_query, answers):
+                    cities[i], codes[i] = city, code_insee
+                    if cache is not None:
+                        cache.set(lats[i], lons[i], city, code_insee)
+                if cache is not None:
+                    cache.flush()
+
+    lookup = pd.DataFrame({
+        'Latitude': lats, 'Longitude': lons,
+        'Ville': cities, 'CODGEO': codes
+    })
+    join_city_codes(geodair, lookup)
+
+
+def join_city_codes(geodair, lookup):
 
-        result[(lat, lon)] = (city, code_insee)
+    """
+    Reporte sur chaque ligne de geodair les colonnes 'Ville' et 'CODGEO' du tableau lookup
+    (une ligne par couple (Latitude, Longitude) unique), par une seule jointure vectorisée.
+    """
 
-        time.sleep(SLEEP_SEC)
+    joined = geodair[['Latitude', 'Longitude']].merge(lookup, on=['Latitude', 'Longitude'], how='left')
 
-    geodair['Ville'] = geodair.apply(lambda r: result[(r['Latitude'], r['Longitude'])][0], axis=1)
-    geodair['CODGEO'] = geodair.apply(lambda r: result[(r['Latitude'], r['Longitude'])][1], axis=1)
+    geodair['Ville'] = joined['Ville'].to_numpy()
+    geodair['CODGEO'] = joined['CODGEO'].to_numpy()
@@ -0,0 +1,553 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LassoCV
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+from scripts.add_city_columns_insee import join_city_codes, load_communes_reference, reverse_insee_offline
+from scripts.geocoding_client import GeocodingClient
+from scripts.config import RENAME_VILLES_FULL, UNAVAILABLE_VALUES, RENAME_GEODAIR
+from scripts import ingest, preprocessing, feature_store, training, cart, lasso, commune_codes
+from scripts import descriptive_visualization as viz
+
+
+def synthetic_geodair(n_rows, n_stations=1000, seed=0):
+    """Extrait Geodair synthétique : n_rows mesures réparties sur n_stations stations"""
+    rng = np.random.default_rng(seed)
+    lats = np.round(rng.uniform(42.5, 51.0, n_stations), 6)
+    lons = np.round(rng.uniform(-4.5, 8.0, n_stations), 6)
+    station = rng.integers(0, n_stations, n_rows)
+
+    geodair = pd.DataFrame({
+        "Latitude": lats[station],
+        "Longitude": lons[station],
+        "valeur brute": rng.gamma(2.0, 10.0, n_rows)
+    })
+    lookup = pd.DataFrame({
+        "Latitude": lats, "Longitude": lons,
+        "Ville": [f"Ville_{i}" for i in range(n_stations)],
+        "CODGEO": [f"{i + 1000:05d}" for i in range(n_stations)]
+    }).drop_duplicates(subset=["Latitude", "Longitude"])
+
+    return geodair, lookup
+
+
+def _join_back_apply(geodair, lookup):
+    """Ancienne version de la jointure (dictionnaire + deux passes DataFrame.apply)"""
+    result = {
+        (lat, lon): (ville, code)
+        for lat, lon, ville, code in lookup[["Latitude", "Longitude", "Ville", "CODGEO"]].itertuples(index=False)
+    }
+    geodair['Ville'] = geodair.apply(lambda r: result[(r['Latitude'], r['Longitude'])][0], axis=1)
+    geodair['CODGEO'] = geodair.apply(lambda r: result[(r['Latitude'], r['Longitude'])][1], axis=1)
+
+
+def bench_join_back(n_rows=1_000_000, n_stations=1000, seed=0):
+    """Compare la jointure ligne à ligne (apply) et la jointure vectorisée (merge)"""
+    geodair, lookup = synthetic_geodair(n_rows, n_stations, seed)
+
+    timings = {}
+    for name, func in [("apply", _join_back_apply), ("merge", join_city_codes)]:
+        df = geodair.copy()
+        start = time.perf_counter()
+        func(df, lookup)
+        timings[name] = time.perf_counter() - start
+        if name == "apply":
+            reference = df[["Ville", "CODGEO"]]
+        else:
+            assert df[["Ville", "CODGEO"]].equals(reference)
+
+    print(f"Jointure sur {n_rows} lignes : apply {timings['apply']:.2f}s, "
+          f"merge {timings['merge']:.3f}s (x{timings['apply'] / timings['merge']:.0f})")
+    return timings
+
+
+class _StubGeocoder(BaseHTTPRequestHandler):
+
+    """ Serveur local imitant /reverse de l'API de géocodage, avec une latence fixe par requête """
+
+    latency = 0.05
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = json.dumps({"features": [{"properties": {"city": "Paris", "citycode": "75056"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_geocoding(n_points=40, latency=0.05, workers=(1, 8)):
+    """
+    Géocodage de n_points par GeocodingClient.reverse_many sur un serveur local de latence fixe
+    (latency secondes par requête), pour chaque nombre de requêtes simultanées de workers
+    """
+    _StubGeocoder.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubGeocoder)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    coords = [(48.85 + i * 1e-4, 2.35) for i in range(n_points)]
+
+    timings = {}
+    try:
+        for n in workers:
+            with GeocodingClient(base_url=f"http://127.0.0.1:{server.server_port}", max_workers=n) as client:
+                start = time.perf_counter()
+                answers = client.reverse_many(coords)
+                timings[n] = time.perf_counter() - start
+            assert answers == [("Paris", "75056")] * n_points
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f"Géocodage de {n_points} points (latence {latency * 1000:.0f} ms) : "
+          + ", ".join(f"{n} requête(s) simultanée(s) {t:.2f}s" for n, t in timings.items()))
+    return timings
+
+
+def check_offline_parity(path="data/processed_data/geodair_2022_villes_codgeo_final.csv", communes=None):
+    """
+    Compare le géocodage hors-ligne (commune de centre le plus proche) aux codes obtenus par l'API
+    (commune contenant la station) sur les stations déjà géocodées de path. Codes comparés après
+    normalisation (arrondissements PLM -> commune). Retourne le taux d'accord et les stations en désaccord.
+    """
+    stations = pd.read_csv(path, usecols=["Latitude", "Longitude", "Ville", "CODGEO"], dtype={"CODGEO": str})
+    stations = stations.dropna(subset=["CODGEO"]).drop_duplicates(subset=["Latitude", "Longitude"])
+    communes = load_communes_reference() if communes is None else communes
+
+    cities, codes = reverse_insee_offline(stations["Latitude"], stations["Longitude"], communes)
+    api, offline = commune_codes.shared_keys(commune_codes.normalize_codes(stations["CODGEO"].to_numpy()),
+                                             commune_codes.normalize_codes(codes))
+    # Les codes de l'API sont tous renseignés : une station hors de l'index (code -1) est en désaccord
+    agree = api.cat.codes.to_numpy() == offline.cat.codes.to_numpy()
+
+    mismatches = stations.loc[~agree].assign(Ville_hors_ligne=cities[~agree], CODGEO_hors_ligne=codes[~agree])
+    print(f"Géocodage hors-ligne : {agree.sum()} / {len(agree)} stations au même code que l'API "
+          f"({agree.mean():.1%})")
+    return agree.mean(), mismatches
+
+
+def bench_ingest(paths=None, repeat=3):
+    """Compare la lecture CSV (pd.read_csv) et la lecture via le cache columnaire (scripts.ingest)"""
+    if paths is None:
+        paths = [
+            "data/raw_data/data.csv",
+            "data/raw_data/BDD_tourisme_communes_2022.csv",
+            "data/raw_data/data_air_2022.csv"
+        ]
+
+    rows = []
+    for path in paths:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            pd.read_csv(path, sep=";")
+        t_csv = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        ingest.read_csv_cached(path, sep=";")
+        t_first = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            ingest.read_csv_cached(path, sep=";")
+        t_cached = (time.perf_counter() - start) / repeat
+
+        rows.append({"fichier": path, "csv_s": t_csv, "premiere_conversion_s": t_first,
+                     "cache_s": t_cached, "gain": t_csv / t_cached})
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    return report
+
+
+def _process_city_data_legacy(df):
+    """Ancienne version de process_city_data (remplacements regex sur tout le dataframe)"""
+    df = df.rename(columns=RENAME_VILLES_FULL)
+    df = df.replace({',': '.'}, regex=True)
+    df = df.replace(UNAVAILABLE_VALUES, np.nan)
+    df["code_geo"] = df["code_geo"].astype(str)
+    df = df[~df["code_geo"].str.startswith(("2A", "2B", "97"))]
+    df["libelle"] = df["libelle"].astype(str)
+    numeric_cols = df.columns.drop(["code_geo", "libelle"])
+    for col in numeric_cols:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def synthetic_city_files(n_communes, out_dir, seed=0):
+    """
+    Écrit des fichiers villes / tourisme synthétiques au format des fichiers INSEE bruts
+    (en-têtes d'origine, virgules décimales, valeurs 'N/A - ...', codes Corse et outre-mer)
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    dep = rng.choice(np.array([f"{d:02d}" for d in range(1, 96) if d != 20] + ["2A", "2B", "971"]), n_communes)
+    codes = pd.Series(dep).str.cat(pd.Series(np.arange(n_communes) % 1000).map("{:03d}".format)).to_numpy()
+    villes = {"Code": codes, "Libellé": [f"Commune {i}, bis" for i in range(n_communes)]}
+
+    for original in RENAME_VILLES_FULL:
+        if original in ("CODGEO", "Libellé", "Nb_hotels_2022", "Nb_campings_2022"):
+            continue
+        values = pd.Series(np.round(rng.gamma(2.0, 20.0, n_communes), 1)).astype(str)
+        values = values.str.replace(".", ",", regex=False).where(rng.random(n_communes) < 0.5, values)
+        values = values.where(rng.random(n_communes) > 0.05, rng.choice(UNAVAILABLE_VALUES, n_communes))
+        villes[original] = values
+
+    tourisme = pd.DataFrame({
+        "CODGEO": codes,
+        "Nb_hotels_2022": rng.poisson(0.5, n_communes),
+        "Nb_campings_2022": rng.poisson(0.3, n_communes)
+    })
+
+    path_villes = os.path.join(out_dir, "data.csv")
+    path_tourisme = os.path.join(out_dir, "BDD_tourisme_communes_2022.csv")
+    pd.DataFrame(villes).to_csv(path_villes, sep=";", index=False)
+    tourisme.to_csv(path_tourisme, sep=";", index=False)
+
+    return path_villes, path_tourisme
+
+
+def _measure(func, *args):
+    """
+    Temps d'exécution et pic mémoire d'un appel. Le pic est mesuré par tracemalloc
+    lors d'un second appel, tracemalloc ralentissant fortement les opérations pandas
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def bench_city_parsing(n_communes=1_000_000, out_dir="data/cache/bench"):
+    """Compare l'ancien nettoyage des villes (regex sur tout le dataframe) et le chargement typé"""
+    path_villes, path_tourisme = synthetic_city_files(n_communes, out_dir)
+
+    legacy, t_legacy, m_legacy = _measure(
+        lambda: _process_city_data_legacy(preprocessing.load_and_merge_cities(path_villes, path_tourisme))
+    )
+    typed, t_typed, m_typed = _measure(preprocessing.load_city_data, path_villes, path_tourisme)
+
+    assert len(legacy) == len(typed)
+    print(f"Nettoyage de {n_communes} communes : ancien {t_legacy:.1f}s / {m_legacy:.0f} Mo, "
+          f"typé {t_typed:.1f}s / {m_typed:.0f} Mo")
+    return {"legacy_s": t_legacy, "legacy_mb": m_legacy, "typed_s": t_typed, "typed_mb": m_typed}
+
+
+def synthetic_store(n_communes=600, pollutants=("NOX as NO2", "O3", "PM10", "PM2.5"), seed=0):
+    """Feature store synthétique (polluant -> FeatureMatrix), avec quelques valeurs manquantes"""
+    rng = np.random.default_rng(seed)
+    store = {}
+    for pol in pollutants:
+        X = rng.gamma(2.0, 20.0, (n_communes, len(feature_store.FEATURES)))
+        X[rng.random(X.shape) < 0.02] = np.nan
+        valeur = np.nan_to_num(X[:, 0]) * 0.1 + np.nan_to_num(X[:, 4]) * 0.3 + rng.gamma(2.0, 5.0, n_communes)
+        df = pd.DataFrame(X, columns=feature_store.FEATURES).assign(valeur=valeur, valeur_brute=valeur)
+        store[pol] = feature_store._matrix(pol, df, feature_store.FEATURES)
+    return store
+
+
+def bench_training(store=None, seed=2003):
+    """
+    Compare les boucles séquentielles du notebook (un GridSearchCV(n_jobs=-1) par polluant et par variante)
+    et le pilote training.train_all (un seul pool pour toutes les validations croisées)
+    """
+    store = synthetic_store() if store is None else store
+
+    start = time.perf_counter()
+    sequential = {}
+    for variant, split in training.SPLITS.items():
+        for pol in store:
+            best_model, _, r2, _, _ = cart.perform_cart_gridsearch(seed, *split(store[pol], seed))
+            sequential[(pol, training.METHODS[variant])] = round(r2, 3)
+    t_sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = training.train_all(store, seed)
+    t_driver = time.perf_counter() - start
+
+    driver = {(r["Pollutant"], r["Method"]): r["R2 Score"] for _, r in table.iterrows()}
+    assert driver == sequential
+    print(f"Entraînement de {len(driver)} modèles : boucles {t_sequential:.1f}s, "
+          f"pool partagé {t_driver:.1f}s (x{t_sequential / t_driver:.1f})")
+    return {"sequential_s": t_sequential, "driver_s": t_driver}
+
+
+def bench_search(store=None, seed=2003, pol="NOX as NO2"):
+    """
+    Compare les stratégies de recherche de perform_cart_gridsearch (nombre d'ajustements, coût pondéré
+    par la taille des données d'apprentissage, temps, r2) sur la grille par défaut et sur une grille élargie :
+    le successive halving fait plus d'ajustements que la grille, mais sur des échantillons réduits
+    """
+    store = synthetic_store() if store is None else store
+    wide_grid = {
+        'max_depth': [3, 4, 5, 6, 7, 8, 10, 12, None],
+        'min_samples_split': [2, 5, 10, 20, 40],
+        'min_samples_leaf': [1, 5, 10, 20, 30],
+        'ccp_alpha': [0.0, 0.0005, 0.001, 0.005]
+    }
+    split = training.naive_split(store[pol], seed)
+
+    rows = []
+    for grid_name, grid in [("défaut", cart.PARAM_GRID), ("élargie", wide_grid)]:
+        for search in cart.SEARCH_STRATEGIES:
+            _, _, r2, _, _, cost = cart.perform_cart_gridsearch(seed, *split, search=search, param_grid=grid,
+                                                                return_cost=True)
+            rows.append({"grille": grid_name, "strategie": search, "ajustements": cost["fits"],
+                         "cout_pondere": cost["weighted_fits"], "temps_s": cost["seconds"], "r2": r2})
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    return report
+
+
+def check_pruning_parity(X, y, seed=2003, params=None):
+    """
+    Vérifie que les sous-arbres évalués analytiquement par le mode "pruning" prédisent exactement
+    comme un DecisionTreeRegressor réajusté avec le ccp_alpha correspondant
+    """
+    params = {"max_depth": 10, "min_samples_split": 10, "min_samples_leaf": 10} if params is None else params
+    X, y = np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    tree = DecisionTreeRegressor(random_state=seed, **params).fit(X, y)
+    path_nodes, path_alphas = cart._pruning_path(tree)
+    preds = cart._pruned_predictions(tree, path_nodes, X)
+
+    reference = tree.cost_complexity_pruning_path(X, y).ccp_alphas
+    assert np.allclose(reference[len(reference) - len(path_alphas):], path_alphas)
+    for alpha in path_alphas[path_alphas > 0]:
+        refit = DecisionTreeRegressor(random_state=seed, ccp_alpha=alpha, **params).fit(X, y)
+        assert np.allclose(refit.predict(X), preds[:, cart._steps_for_alpha(path_alphas, alpha)])
+    return len(path_alphas)
+
+
+def bench_pruning(store=None, seed=2003):
+    """
+    Compare, pour chaque polluant et chaque variante, la grille actuelle (ccp_alpha dans {0, 0.001})
+    et le mode "pruning" (ccp_alpha choisi sur tout le chemin d'élagage) : r2, ajustements, temps
+    """
+    store = synthetic_store() if store is None else store
+
+    rows = []
+    for variant, split in training.SPLITS.items():
+        for pol in store:
+            data = split(store[pol], seed)
+            check_pruning_parity(data[0], data[2], seed)
+            for search in ("grid", "pruning"):
+                best_model, _, r2, _, _, cost = cart.perform_cart_gridsearch(seed, *data, search=search,
+                                                                             return_cost=True)
+                rows.append({"polluant": pol, "variante": variant, "strategie": search, "r2": r2,
+                             "ccp_alpha": best_model.ccp_alpha, "ajustements": cost["fits"],
+                             "cout_pondere": cost["weighted_fits"], "temps_s": cost["seconds"]})
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    return report
+
+
+# Taille des fichiers livrés dans data/raw_data (échelle 1)
+SHIPPED_ROWS = {"villes": 34875, "geodair": 1141}
+SCALES = (1, 10, 100)
+RESULTS_DIR = "output/benchmarks"
+
+
+def synthetic_geodair_frame(n_rows, codes, seed=0):
+    """
+    Mesures Geodair synthétiques au schéma des données géocodées (en-têtes d'origine de RENAME_GEODAIR) :
+    stations rattachées à des communes de codes (dont des arrondissements de Paris, Lyon et Marseille)
+    """
+    rng = np.random.default_rng(seed)
+    n_stations = max(n_rows // 4, 1)
+    codes = np.concatenate([np.asarray(codes, dtype=object), np.array(["75101", "69381", "13201"], dtype=object)])
+    station_code = rng.choice(codes, n_stations)
+    lats = np.round(rng.uniform(42.5, 51.0, n_stations), 6)
+    lons = np.round(rng.uniform(-4.5, 8.0, n_stations), 6)
+    station = rng.integers(0, n_stations, n_rows)
+    valeur = np.round(rng.gamma(2.0, 10.0, n_rows), 1)
+
+    columns = {
+        "Date de début": "2022/01/01 00:00:00",
+        "Date de fin": "2022/12/31 23:59:59",
+        "Organisme": rng.choice(["ATMO GRAND EST", "AIRPARIF", "ATMO SUD"], n_rows),
+        "code zas": "FR00ZAG00",
+        "Zas": "ZAG",
+        "code site": pd.Series(station).map("FR{:05d}".format).to_numpy(),
+        "nom site": pd.Series(station).map("Site {}".format).to_numpy(),
+        "type d'implantation": rng.choice(["Urbaine", "Périurbaine", "Rurale"], n_rows),
+        "Polluant": rng.choice(["NOX as NO2", "O3", "PM10", "PM2.5"], n_rows),
+        "type d'influence": rng.choice(["Fond", "Trafic", "Industrielle"], n_rows),
+        "Réglementaire": "Oui",
+        "type d'évaluation": "mesures fixes",
+        "type de valeur": "Moy. annuelle",
+        "valeur": pd.Series(valeur).astype(str).str.replace(".", ",", regex=False).to_numpy(),
+        "valeur brute": valeur + rng.normal(0, 0.5, n_rows),
+        "unité de mesure": "µg-m3",
+        "taux de saisie": np.nan,
+        "couverture temporelle": np.nan,
+        "couverture de données": np.nan,
+        "code qualité": "R",
+        "validité": 1,
+        "Latitude": lats[station],
+        "Longitude": lons[station],
+        "Ville": pd.Series(station_code[station]).map("Ville {}".format).to_numpy(),
+        "CODGEO": station_code[station],
+        "Latitude_commune": np.round(lats[station], 3),
+        "Longitude_commune": np.round(lons[station], 3)
+    }
+    assert list(columns) == list(RENAME_GEODAIR)
+    return pd.DataFrame(columns)
+
+
+def synthetic_inputs(scale=1, out_dir="data/cache/bench", seed=0):
+    """
+    Fichiers villes / tourisme (schéma de RENAME_VILLES_FULL) et mesures Geodair géocodées
+    à scale fois la taille des fichiers livrés
+    """
+    out_dir = os.path.join(out_dir, f"x{scale}")
+    path_villes, path_tourisme = synthetic_city_files(SHIPPED_ROWS["villes"] * scale, out_dir, seed)
+    codes = pd.read_csv(path_villes, sep=";", usecols=["Code"], dtype=str)["Code"].unique()
+    geodair = synthetic_geodair_frame(SHIPPED_ROWS["geodair"] * scale, codes, seed)
+    return path_villes, path_tourisme, geodair
+
+
+def _in_tmp_dir(func, parent):
+    """ Appel de func(dossier) dans un dossier temporaire supprimé ensuite (figures, feature store) """
+    with tempfile.TemporaryDirectory(dir=parent) as d:
+        return func(d)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+
+
+def bench_suite(scales=SCALES, seed=2003, out_dir="data/cache/bench", results_dir=RESULTS_DIR, pol="NOX as NO2"):
+    """
+    Temps et pic mémoire des fonctions publiques de la chaîne (nettoyage, fusion, agrégation, modèles,
+    graphiques) sur des données synthétiques à chaque échelle de scales (1 = taille des fichiers livrés).
+    Écrit les résultats (JSON) dans results_dir, sous le nom du commit courant, pour comparaison
+    avec compare_benchmarks. Les étapes parallélisables (CART, graphiques) sont mesurées avec n_jobs=1 :
+    tracemalloc ne voit pas la mémoire des processus joblib. Les fichiers écrits (figures, feature store)
+    le sont dans un dossier temporaire supprimé après chaque appel.
+    """
+    vars_eco = {"population_2022": False, "densite_population_2022": False, "mediane_niveau_vie_2021": False}
+    lasso_pipeline = Pipeline(steps=[
+        ("preprocess", StandardScaler()),
+        ("model", LassoCV(alphas=lasso.ALPHAS, fit_intercept=True, random_state=0, cv=lasso.CV_FOLDS))
+    ])
+
+    rows = []
+    for scale in scales:
+        path_villes, path_tourisme, geodair = synthetic_inputs(scale, out_dir, seed)
+        df_raw = preprocessing.load_and_merge_cities(path_villes, path_tourisme)
+        scale_dir = os.path.join(out_dir, f"x{scale}")
+        data = {}
+
+        def sample():
+            return data["groupe"][data["groupe"]["polluant"] == pol]
+
+        # (fonction, appel (dossier temporaire propre à l'appel), nombre de lignes traitées, nom du résultat
+        # réutilisé par les étapes suivantes). Tout s'exécute dans ce processus (n_jobs=1) pour que
+        # tracemalloc mesure réellement le pic mémoire
+        steps = [
+            ("process_city_data", lambda d: preprocessing.process_city_data(df_raw), lambda: len(df_raw), "villes"),
+            ("prepare_geodair_data", lambda d: preprocessing.prepare_geodair_data(geodair, data["villes"]),
+             lambda: len(geodair), "etude"),
+            ("aggregate_by_pollutant", lambda d: preprocessing.aggregate_by_pollutant(data["etude"]),
+             lambda: len(data["etude"]), "groupe"),
+            ("build_feature_store", lambda d: feature_store.build_feature_store(data["groupe"], store_dir=d),
+             lambda: len(data["groupe"]), "store"),
+            ("perform_cart_gridsearch", lambda d: cart.perform_cart_gridsearch(
+                seed, *training.naive_split(data["store"][pol], seed), n_jobs=1), lambda: len(sample()), None),
+            ("lasso_select_and_OLS", lambda d: lasso.lasso_select_and_OLS(data["store"][pol], lasso_pipeline),
+             lambda: len(sample()), None),
+            ("plot_distributions", lambda d: viz.plot_distributions(data["villes"], list(vars_eco), output_dir=d,
+                                                                    n_jobs=1), lambda: len(data["villes"]), None),
+            ("plot_correlation_heatmap", lambda d: viz.plot_correlation_heatmap(sample(), output_dir=d, pol=pol),
+             lambda: len(sample()), None),
+            ("plot_comparative_distributions", lambda d: viz.plot_comparative_distributions(
+                sample(), data["villes"], pol, vars_eco, output_dir=d, n_jobs=1), lambda: len(data["villes"]), None),
+            ("plot_combined_distributions_per_var", lambda d: viz.plot_combined_distributions_per_var(
+                dict(tuple(data["groupe"].groupby("polluant"))), data["villes"], vars_eco, output_dir=d, n_jobs=1),
+             lambda: len(data["villes"]), None)
+        ]
+
+        for name, func, size, keep in steps:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result, elapsed, peak = _measure(partial(_in_tmp_dir, func, scale_dir))
+            if keep is not None:
+                data[keep] = result
+            rows.append({"fonction": name, "echelle": scale, "lignes": int(size()),
+                         "temps_s": round(elapsed, 4), "pic_mo": round(peak, 2)})
+            print(f"x{scale:<4} {name:<36} {elapsed:8.3f}s {peak:9.1f} Mo")
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": rows
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"bench-{commit}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print(f"Résultats enregistrés dans : {path}")
+    return pd.DataFrame(rows)
+
+
+def compare_benchmarks(reference_path, new_path, tolerance=1.2):
+    """
+    Compare deux fichiers de bench_suite : ratio des temps et des pics mémoire par fonction et échelle.
+    Les lignes dont un ratio dépasse tolerance sont marquées comme régressions.
+    """
+    frames = []
+    for path in (reference_path, new_path):
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)["results"]).set_index(["fonction", "echelle"]))
+    ref, new = frames
+
+    report = pd.DataFrame({
+        "temps_ref_s": ref["temps_s"], "temps_s": new["temps_s"],
+        "ratio_temps": (new["temps_s"] / ref["temps_s"]).round(2),
+        "pic_ref_mo": ref["pic_mo"], "pic_mo": new["pic_mo"],
+        "ratio_pic": (new["pic_mo"] / ref["pic_mo"]).round(2)
+    }).dropna(subset=["temps_s", "temps_ref_s"])
+    report["regression"] = (report["ratio_temps"] > tolerance) | (report["ratio_pic"] > tolerance)
+    print(report.to_string())
+    return report
+
+
+if __name__ == "__main__":
+    bench_join_back()
+    bench_ingest()
+    bench_city_parsing()
+    bench_training()
+    bench_search()
+    bench_pruning()
+    bench_suite()
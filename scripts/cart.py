@@ -1,27 +1,33 @@
+import math
+import time
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.ensemble import RandomForestRegressor
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, KFold, ParameterGrid
+from sklearn.pipeline import Pipeline
+from scripts import profiling
 
+PARAM_GRID = {
+    'max_depth': [3, 5, 7, 10],
+    'min_samples_split': [10, 20],
+    'min_samples_leaf': [10, 20, 30],
+    'ccp_alpha': [0.0, 0.001]
+}
+CV_FOLDS = 5
 
-def perform_cart_gridsearch(seed, X_train, X_test, y_train, y_test, log_conversion=False):
-    """ Génère l'arbre CART optimal au sens de la squarred_error par GridSearch """
-    # Grid Search
-    param_grid = {
-        'max_depth': [3, 5, 7, 10], 
-        'min_samples_split': [10, 20],
-        'min_samples_leaf': [10, 20, 30],
-        'ccp_alpha': [0.0, 0.001]
-    }
-
-    model = DecisionTreeRegressor(criterion="squared_error", random_state=seed)
+# Stratégies de recherche des hyperparamètres
+SEARCH_STRATEGIES = ("grid", "halving", "smbo", "pruning")
+HALVING_FACTOR = 3        # Part des candidats conservés à chaque tour : 1 / HALVING_FACTOR
+HALVING_MIN_SAMPLES = 60  # Taille minimale des folds d'apprentissage au premier tour
+SMBO_INIT = 8             # Candidats tirés au hasard avant d'ajuster le modèle de substitution
+SMBO_MAX_CANDIDATES = 20  # Candidats évalués par défaut (sans budget)
+SMBO_KAPPA = 1.0          # Poids de l'incertitude dans le critère d'acquisition (borne supérieure)
 
-    grid = GridSearchCV(model, param_grid, cv=5, scoring='r2', n_jobs=-1)
-    grid.fit(X_train, y_train)
 
-    best_model = grid.best_estimator_
-
-    # Prédictions sur le Test
+def _evaluate(best_model, X_test, y_test, log_conversion):
+    """ Prédictions sur le Test et métriques (r2, rmse, mae), en repassant en échelle réelle si besoin """
     y_pred_log = best_model.predict(X_test)
 
     if log_conversion:
@@ -37,3 +43,376 @@ def perform_cart_gridsearch(seed, X_train, X_test, y_train, y_test, log_conversi
         rmse = np.sqrt(mean_squared_error(y_test, y_pred_log))
         mae = mean_absolute_error(y_test, y_pred_log)
         return best_model, y_pred_log, r2, rmse, mae
+
+
+class SearchBudget:
+
+    """ Budget d'une recherche d'hyperparamètres, en nombre d'ajustements (max_fits) et/ou en secondes (max_time) """
+
+    def __init__(self, max_fits=None, max_time=None):
+        self.max_fits = max_fits
+        self.max_time = max_time
+        self.fits = 0
+        self.weighted_fits = 0.0
+        self.start = time.perf_counter()
+
+    def spend(self, n_fits, fraction=1.0):
+        """ Comptabilise n_fits ajustements, chacun sur fraction de la taille des folds d'apprentissage """
+        self.fits += n_fits
+        self.weighted_fits += n_fits * fraction
+
+    def cost(self):
+        """ Coût de la recherche : ajustements, ajustements pondérés par la taille des données, secondes """
+        return {"fits": self.fits, "weighted_fits": round(self.weighted_fits, 3),
+                "seconds": time.perf_counter() - self.start}
+
+    def affordable(self, cost):
+        """ Nombre d'évaluations de coût cost encore possibles (None : pas de limite) """
+        if self.max_time is not None and time.perf_counter() - self.start >= self.max_time:
+            return 0
+        if self.max_fits is None:
+            return None
+        return max(0, (self.max_fits - self.fits) // cost)
+
+
+@profiling.timed()
+def perform_cart_gridsearch(seed, X_train, X_test, y_train, y_test, log_conversion=False,
+                            search="grid", param_grid=None, max_fits=None, max_time=None, n_jobs=-1,
+                            preprocessor=None, return_cost=False):
+    """
+    Génère l'arbre CART optimal au sens de la squarred_error, selon la stratégie search :
+    - "grid" : GridSearch exhaustif sur param_grid (PARAM_GRID par défaut);
+    - "halving" : successive halving, les candidats sont évalués sur des folds d'apprentissage
+      de taille croissante et seul le meilleur tiers passe au tour suivant;
+    - "smbo" : recherche séquentielle guidée par un modèle de substitution (forêt aléatoire, graine seed);
+    - "pruning" : un seul arbre par jeu de paramètres (hors ccp_alpha) et par fold, dont tout le chemin
+      d'élagage coût-complexité est évalué sans réajustement; ccp_alpha est choisi sur ce chemin continu.
+    max_fits (nombre d'ajustements d'arbres) et max_time (secondes) bornent la recherche.
+    return_cost=True ajoute au résultat le coût de la recherche, réajustement final compris : nombre
+    d'ajustements (fits), somme des tailles d'apprentissage rapportées à celle d'un fold complet
+    (weighted_fits, comparable entre stratégies : un tour de halving sur un neuvième des données compte 1/9)
+    et durée en secondes (seconds).
+    preprocessor (ex. ClusterTargetEncoder) est ajusté dans chaque fold, en amont de l'arbre, au sein
+    d'un Pipeline : le modèle retourné est alors ce Pipeline.
+    """
+    if search not in SEARCH_STRATEGIES:
+        raise ValueError(f"Stratégie inconnue : {search} (attendu : {', '.join(SEARCH_STRATEGIES)})")
+    exhaustive = search == "grid" and max_fits is None and max_time is None
+    if preprocessor is not None and not exhaustive:
+        raise ValueError("preprocessor n'est disponible qu'avec le GridSearch exhaustif (search='grid', sans budget)")
+    param_grid = PARAM_GRID if param_grid is None else param_grid
+    budget = SearchBudget(max_fits, max_time)
+    # Taille d'un fold d'apprentissage, unité du coût pondéré (le réajustement final porte sur tout X_train)
+    refit_fraction = CV_FOLDS / (CV_FOLDS - 1)
+
+    if exhaustive:
+        model = DecisionTreeRegressor(criterion="squared_error", random_state=seed)
+        if preprocessor is not None:
+            model = Pipeline([("preprocess", preprocessor), ("model", model)])
+            param_grid = {f"model__{k}": v for k, v in param_grid.items()}
+
+        grid = GridSearchCV(model, param_grid, cv=CV_FOLDS, scoring='r2', n_jobs=n_jobs)
+        grid.fit(X_train, y_train)
+
+        best_model = grid.best_estimator_
+        budget.spend(len(grid.cv_results_["params"]) * CV_FOLDS)
+        budget.spend(1, refit_fraction)
+        return _result(_evaluate(best_model, X_test, y_test, log_conversion), budget, return_cost)
+
+    X = np.asarray(X_train, dtype=np.float64)
+    y = np.asarray(y_train, dtype=np.float64)
+    folds = list(KFold(n_splits=CV_FOLDS).split(X))
+
+    candidates = list(ParameterGrid(param_grid))
+    if search == "grid":
+        scores = _run_candidates(seed, candidates, X, y, folds, budget, n_jobs=n_jobs)
+        best_params = candidates[_best(scores)] if scores else candidates[0]
+    elif search == "halving":
+        best_params = _search_halving(seed, candidates, X, y, folds, budget, n_jobs)
+    elif search == "smbo":
+        best_params = _search_smbo(seed, candidates, param_grid, X, y, folds, budget)
+    else:
+        best_params = _search_pruning(seed, param_grid, X, y, folds, budget, n_jobs)
+
+    best_model = DecisionTreeRegressor(criterion="squared_error", random_state=seed, **best_params)
+    best_model.fit(X_train, y_train)
+    budget.spend(1, refit_fraction)
+    return _result(_evaluate(best_model, X_test, y_test, log_conversion), budget, return_cost)
+
+
+def _result(evaluation, budget, return_cost):
+    """ Résultat de _evaluate, suivi du coût de la recherche si return_cost """
+    return (*evaluation, budget.cost()) if return_cost else evaluation
+
+
+def _best(scores):
+    """ Indice du premier meilleur score (les scores NaN sont classés en dernier) """
+    return int(np.argmax(np.nan_to_num(np.asarray(scores, dtype=float), nan=-np.inf)))
+
+
+def _run_candidates(seed, candidates, X, y, folds, budget, n_samples=None, n_jobs=-1):
+    """
+    Scores de validation croisée des candidats, par paquets de la taille du pool, tant que le budget
+    le permet : la liste retournée peut être plus courte que candidates
+    """
+    scores = []
+    batch = effective_n_jobs(n_jobs)
+    fraction = 1.0 if n_samples is None else float(np.mean([min(n_samples, len(t)) / len(t) for t, _ in folds]))
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, len(candidates), batch):
+            n = budget.affordable(CV_FOLDS)
+            if n == 0:
+                break
+            chunk = candidates[start:start + (batch if n is None else min(batch, n))]
+            if len(chunk) == 1:
+                out = [_cv_scores(seed, chunk, X, y, folds, n_samples)]
+            else:
+                out = parallel(delayed(_cv_scores)(seed, [p], X, y, folds, n_samples) for p in chunk)
+            scores += [o[0] for o in out]
+            budget.spend(len(chunk) * CV_FOLDS, fraction)
+    return scores
+
+
+def _search_halving(seed, candidates, X, y, folds, budget, n_jobs=-1, factor=HALVING_FACTOR):
+    """ Successive halving : la taille des folds d'apprentissage est multipliée par factor à chaque tour """
+    rng = np.random.default_rng(seed)
+    folds = [(rng.permutation(train), val) for train, val in folds]
+    n_max = min(len(train) for train, _ in folds)
+    n_rounds = math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 0
+    n_samples = max(min(n_max, HALVING_MIN_SAMPLES), n_max // factor ** n_rounds)
+
+    best = candidates[0]
+    while True:
+        scores = _run_candidates(seed, candidates, X, y, folds, budget, n_samples, n_jobs)
+        if not scores:
+            return best
+        best = candidates[_best(scores)]
+        if len(scores) < len(candidates) or len(candidates) == 1 or n_samples >= n_max:
+            return best
+
+        keep = math.ceil(len(candidates) / factor)
+        order = np.argsort(-np.nan_to_num(np.asarray(scores), nan=-np.inf), kind="stable")[:keep]
+        candidates = [candidates[i] for i in sorted(order)]
+        n_samples = min(n_max, n_samples * factor)
+
+
+def _search_smbo(seed, candidates, param_grid, X, y, folds, budget):
+    """
+    Recherche séquentielle guidée par un modèle : après SMBO_INIT tirages aléatoires, une forêt aléatoire
+    ajustée sur les scores déjà obtenus choisit le candidat de plus grande borne supérieure (moyenne
+    + SMBO_KAPPA x écart-type entre arbres)
+    """
+    rng = np.random.default_rng(seed)
+    # Paramètres encodés par leur rang dans la liste des valeurs de param_grid
+    keys = sorted(param_grid)
+    space = np.array([[list(param_grid[k]).index(p[k]) for k in keys] for p in candidates], dtype=float)
+    limit = len(candidates) if budget.max_fits is not None or budget.max_time is not None else SMBO_MAX_CANDIDATES
+    order = rng.permutation(len(candidates))
+
+    evaluated, scores = [], []
+    while len(evaluated) < min(limit, len(candidates)):
+        if len(evaluated) < SMBO_INIT:
+            i = order[len(evaluated)]
+        else:
+            surrogate = RandomForestRegressor(n_estimators=50, random_state=seed)
+            surrogate.fit(space[evaluated], np.nan_to_num(scores, nan=-1.0))
+            rest = np.setdiff1d(np.arange(len(candidates)), evaluated)
+            per_tree = np.stack([tree.predict(space[rest]) for tree in surrogate.estimators_])
+            i = rest[np.argmax(per_tree.mean(axis=0) + SMBO_KAPPA * per_tree.std(axis=0))]
+
+        score = _run_candidates(seed, [candidates[i]], X, y, folds, budget, n_jobs=1)
+        if not score:
+            break
+        evaluated.append(int(i))
+        scores.append(score[0])
+
+    return candidates[evaluated[_best(scores)]] if evaluated else candidates[0]
+
+
+def _pruning_path(tree):
+    """
+    Élagage coût-complexité par maillon faible d'un arbre ajusté (même algorithme et mêmes départages
+    que sklearn) : nœud élagué et alpha effectif de chaque étape, jusqu'à la racine seule
+    """
+    t = tree.tree_
+    left, right = t.children_left, t.children_right
+    n_nodes = t.node_count
+    r_node = t.weighted_n_node_samples * t.impurity / t.weighted_n_node_samples[0]
+
+    parent = np.full(n_nodes, -1)
+    internal = left != -1
+    parent[left[internal]] = np.flatnonzero(internal)
+    parent[right[internal]] = np.flatnonzero(internal)
+
+    # Coût et nombre de feuilles de chaque branche, remontés feuille par feuille
+    is_leaf = ~internal
+    r_branch = np.zeros(n_nodes)
+    n_leaves = np.zeros(n_nodes)
+    for leaf in np.flatnonzero(is_leaf):
+        r_branch[leaf] = r_node[leaf]
+        node = leaf
+        while node != 0:
+            node = parent[node]
+            r_branch[node] += r_node[leaf]
+            n_leaves[node] += 1
+
+    in_subtree = np.ones(n_nodes, dtype=bool)
+    nodes, alphas = [], []
+    while not is_leaf[0]:
+        candidates = np.flatnonzero(in_subtree & ~is_leaf)
+        effective = (r_node[candidates] - r_branch[candidates]) / (n_leaves[candidates] - 1)
+        j = candidates[np.argmin(effective)]
+        nodes.append(j)
+        alphas.append(effective.min())
+
+        # La branche j devient une feuille : ses descendants sortent de l'arbre
+        stack = [left[j], right[j]]
+        while stack:
+            node = stack.pop()
+            in_subtree[node] = False
+            if internal[node]:
+                stack += [left[node], right[node]]
+        is_leaf[j] = True
+        n_pruned_leaves = n_leaves[j] - 1
+        r_diff = r_node[j] - r_branch[j]
+        node = parent[j]
+        while node != -1:
+            n_leaves[node] -= n_pruned_leaves
+            r_branch[node] += r_diff
+            node = parent[node]
+
+    return np.array(nodes, dtype=int), np.array(alphas)
+
+
+def _pruned_predictions(tree, path_nodes, X):
+    """
+    Prédictions de tous les sous-arbres du chemin d'élagage : la colonne k correspond à l'arbre
+    après les k premières étapes (une observation prend la valeur du plus haut nœud élagué de son chemin)
+    """
+    t = tree.tree_
+    values = t.value[:, 0, 0]
+    parent = np.full(t.node_count, -1)
+    internal = t.children_left != -1
+    parent[t.children_left[internal]] = np.flatnonzero(internal)
+    parent[t.children_right[internal]] = np.flatnonzero(internal)
+
+    step = np.full(t.node_count, np.inf)
+    step[path_nodes] = np.arange(len(path_nodes))
+    k = np.arange(len(path_nodes) + 1)[:, None]
+
+    leaves = tree.apply(X)
+    out = np.empty((len(X), len(path_nodes) + 1))
+    for leaf in np.unique(leaves):
+        path = [leaf]
+        while path[-1] != 0:
+            path.append(parent[path[-1]])
+        path = np.array(path[::-1])
+        collapsed = step[path][None, :] < k
+        first = np.where(collapsed.any(axis=1), collapsed.argmax(axis=1), len(path) - 1)
+        out[leaves == leaf] = values[path][first]
+    return out
+
+
+def _path_scores(seed, params, X, y, folds):
+    """ Pour chaque fold : alphas du chemin d'élagage et score r2 de chacun des sous-arbres """
+    result = []
+    for train, val in folds:
+        tree = DecisionTreeRegressor(criterion="squared_error", random_state=seed, **params).fit(X[train], y[train])
+        path_nodes, path_alphas = _pruning_path(tree)
+        preds = _pruned_predictions(tree, path_nodes, X[val])
+        result.append((path_alphas, np.array([r2_score(y[val], preds[:, k]) for k in range(preds.shape[1])])))
+    return result
+
+
+def _steps_for_alpha(path_alphas, alpha):
+    """ Nombre d'étapes d'élagage appliquées par sklearn pour ccp_alpha = alpha (aucune si alpha = 0) """
+    if alpha <= 0:
+        return 0
+    above = np.flatnonzero(path_alphas > alpha)
+    return int(above[0]) if len(above) else len(path_alphas)
+
+
+def _search_pruning(seed, param_grid, X, y, folds, budget, n_jobs=-1):
+    """
+    Un arbre par jeu de paramètres (hors ccp_alpha) et par fold; chaque alpha du chemin d'élagage
+    d'un des folds est un candidat, évalué sur tous les folds par le sous-arbre correspondant
+    """
+    settings = list(ParameterGrid({k: v for k, v in param_grid.items() if k != "ccp_alpha"}))
+
+    folds_results = []
+    batch = effective_n_jobs(n_jobs)
+    with Parallel(n_jobs=n_jobs) as parallel:
+        for start in range(0, len(settings), batch):
+            n = budget.affordable(CV_FOLDS)
+            if n == 0:
+                break
+            chunk = settings[start:start + (batch if n is None else min(batch, n))]
+            folds_results += parallel(delayed(_path_scores)(seed, p, X, y, folds) for p in chunk)
+            budget.spend(len(chunk) * CV_FOLDS)
+
+    best, best_score = dict(settings[0], ccp_alpha=0.0), -np.inf
+    for params, per_fold in zip(settings, folds_results):
+        alphas = np.unique(np.concatenate([[0.0]] + [a[a > 0] for a, _ in per_fold]))
+        scores = np.mean([[s[_steps_for_alpha(a, alpha)] for alpha in alphas] for a, s in per_fold], axis=0)
+        i = _best(scores)
+        if scores[i] > best_score:
+            best, best_score = dict(params, ccp_alpha=float(alphas[i])), scores[i]
+    return best
+
+
+def _cv_scores(seed, params_list, X, y, folds, n_samples=None):
+    """
+    Score r2 moyen en validation croisée de chaque jeu de paramètres d'un paquet
+    (n_samples : taille maximale des folds d'apprentissage, pour le successive halving)
+    """
+    scores = []
+    for params in params_list:
+        fold_scores = []
+        for train, val in folds:
+            train = train[:n_samples] if n_samples is not None else train
+            model = DecisionTreeRegressor(criterion="squared_error", random_state=seed, **params)
+            model.fit(X[train], y[train])
+            fold_scores.append(r2_score(y[val], model.predict(X[val])))
+        scores.append(np.mean(fold_scores))
+    return scores
+
+
+@profiling.timed()
+def perform_cart_gridsearch_many(seed, datasets, n_jobs=-1, tasks_per_worker=4):
+    """
+    Équivalent de perform_cart_gridsearch pour plusieurs jeux de données à la fois
+    (datasets : nom -> (X_train, X_test, y_train, y_test, log_conversion)).
+    Toutes les validations croisées (jeux de données x paramètres) partagent un même pool de workers;
+    les paramètres sont regroupés en paquets pour limiter le coût d'ordonnancement, et les données
+    sont transmises aux workers en mémoire partagée (memmapping joblib).
+    Retourne nom -> (best_model, y_pred, r2, rmse, mae), avec le même choix de paramètres que GridSearchCV.
+    """
+    grid = list(ParameterGrid(PARAM_GRID))
+    arrays = {
+        name: (np.asarray(X_train, dtype=np.float64), np.asarray(y_train, dtype=np.float64))
+        for name, (X_train, _, y_train, _, _) in datasets.items()
+    }
+    folds = {name: list(KFold(n_splits=CV_FOLDS).split(X)) for name, (X, _) in arrays.items()}
+
+    with Parallel(n_jobs=n_jobs, max_nbytes="1K") as parallel:
+        n_chunks = max(1, min(len(grid), -(-tasks_per_worker * effective_n_jobs(n_jobs) // len(datasets))))
+        chunks = [list(c) for c in np.array_split(np.arange(len(grid)), n_chunks)]
+        tasks = [(name, chunk) for name in datasets for chunk in chunks]
+        outputs = parallel(
+            delayed(_cv_scores)(seed, [grid[i] for i in chunk], *arrays[name], folds[name])
+            for name, chunk in tasks
+        )
+
+    scores = {name: np.empty(len(grid)) for name in datasets}
+    for (name, chunk), out in zip(tasks, outputs):
+        scores[name][chunk] = out
+
+    results = {}
+    for name, (X_train, X_test, y_train, y_test, log_conversion) in datasets.items():
+        # Premier meilleur score, comme le rang 1 de GridSearchCV
+        best_params = grid[_best(scores[name])]
+        best_model = DecisionTreeRegressor(criterion="squared_error", random_state=seed, **best_params)
+        best_model.fit(X_train, y_train)
+        results[name] = _evaluate(best_model, X_test, y_test, log_conversion)
+
+    return results
@@ -0,0 +1,104 @@
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+N_CLUSTERS = 10
+BACKENDS = ("kmeans", "minibatch")
+BATCH_SIZE = 1024
+CACHE_SIZE = 8        # Clusterings conservés (les moins récemment utilisés sont évincés)
+
+# Clusterings déjà ajustés, indexés par l'empreinte de la matrice et des paramètres (ordre LRU)
+_CENTROIDS = OrderedDict()
+
+
+def _clustering_key(X, params):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(X).tobytes())
+    h.update(str(X.shape).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def fit_clustering(X, n_clusters=N_CLUSTERS, backend="kmeans", random_state=None, n_init=10,
+                   batch_size=BATCH_SIZE, cache=True):
+    """
+    Standardisation puis KMeans (backend="kmeans") ou MiniBatchKMeans (backend="minibatch") sur X.
+    Avec cache=True, le couple (scaler, kmeans) ajusté est mémorisé par empreinte de X et des
+    paramètres (au plus CACHE_SIZE clusterings) : un même référentiel de communes n'est partitionné
+    qu'une fois. Chaque appel retourne sa propre copie, modifiable sans effet sur le cache.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+
+    X = np.asarray(X, dtype=np.float64)
+    params = {"n_clusters": n_clusters, "backend": backend, "random_state": random_state,
+              "n_init": n_init, "batch_size": batch_size}
+    key = _clustering_key(X, params) if cache else None
+    if key in _CENTROIDS:
+        _CENTROIDS.move_to_end(key)
+        return copy.deepcopy(_CENTROIDS[key])
+
+    scaler = StandardScaler().fit(X)
+    if backend == "kmeans":
+        kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init)
+    else:
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=n_init,
+                                 batch_size=batch_size)
+    kmeans.fit(scaler.transform(X))
+
+    if cache:
+        _CENTROIDS[key] = copy.deepcopy((scaler, kmeans))
+        if len(_CENTROIDS) > CACHE_SIZE:
+            _CENTROIDS.popitem(last=False)
+    return scaler, kmeans
+
+
+class ClusterTargetEncoder(TransformerMixin, BaseEstimator):
+
+    """
+    Target encoding par cluster de villes, compatible scikit-learn (utilisable dans un Pipeline,
+    donc sans fuite de la cible entre folds) :
+    - les villes sont partitionnées (StandardScaler + KMeans / MiniBatchKMeans) sur reference si fourni
+      (par exemple toutes les communes de France), sinon sur les données d'apprentissage;
+    - fit calcule la statistique (médiane par défaut) de la cible par cluster sur les données d'apprentissage;
+    - transform ajoute la colonne 'cluster_expected' : statistique du centroïde le plus proche
+      (statistique globale pour un cluster absent de l'apprentissage).
+    """
+
+    def __init__(self, n_clusters=N_CLUSTERS, backend="kmeans", random_state=None, n_init=10,
+                 batch_size=BATCH_SIZE, reference=None, statistic="median", cache=True):
+        self.n_clusters = n_clusters
+        self.backend = backend
+        self.random_state = random_state
+        self.n_init = n_init
+        self.batch_size = batch_size
+        self.reference = reference
+        self.statistic = statistic
+        self.cache = cache
+
+    def fit(self, X, y):
+        reference = X if self.reference is None else self.reference
+        self.scaler_, self.kmeans_ = fit_clustering(
+            reference, self.n_clusters, self.backend, self.random_state, self.n_init, self.batch_size, self.cache
+        )
+        y = pd.Series(np.asarray(y, dtype=np.float64))
+        self.cluster_stats_ = y.groupby(self.predict_cluster(X)).agg(self.statistic)
+        self.global_stat_ = y.agg(self.statistic)
+        self.n_features_in_ = np.shape(X)[1]
+        return self
+
+    def predict_cluster(self, X):
+        """ Cluster de chaque ville : centroïde le plus proche (O(k) par ville) """
+        return self.kmeans_.predict(self.scaler_.transform(np.asarray(X, dtype=np.float64)))
+
+    def transform(self, X):
+        encoded = pd.Series(self.predict_cluster(X)).map(self.cluster_stats_).fillna(self.global_stat_).to_numpy()
+        if isinstance(X, pd.DataFrame):
+            return X.assign(cluster_expected=encoded)
+        return np.column_stack([X, encoded])
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from scripts.config import COG_MAPPING, EXCLUDED_PREFIXES
+
+
+def normalize_codes(codes, mapping=COG_MAPPING):
+    """
+    Normalisation des codes communes : texte sur 5 caractères (un code lu comme flottant,
+    ex. 1001.0, redevient '01001'), puis passage au code de jointure via la table mapping
+    (arrondissements PLM -> commune mère, ...). Les traitements ne portent que sur les valeurs
+    distinctes : le résultat est une série catégorielle.
+    Le complément à 5 caractères corrige la jointure des codes lus comme entiers (départements 01 à 09 :
+    Nice, Cannes, Gap, ...), qui échouaient auparavant : 61 mesures Geodair de plus sont rattachées à
+    leur commune, ce qui modifie les tableaux LASSO / CART et les cartes du notebook.
+    """
+    codes = pd.Series(codes)
+    cat = codes.astype("category").cat
+
+    uniques = pd.Series(cat.categories.astype(str))
+    uniques = uniques.str.replace(r"\.0$", "", regex=True).str.zfill(5)
+    if mapping:
+        uniques = uniques.map(mapping).fillna(uniques)
+
+    # Plusieurs anciens codes peuvent pointer vers le même code : recodage des catégories
+    # (la case ajoutée en fin de tableau conserve le code -1 des valeurs manquantes)
+    categories = pd.Index(uniques.unique()).sort_values()
+    recode = np.append(categories.get_indexer(uniques), -1)
+    new_codes = recode[cat.codes.to_numpy()]
+
+    return pd.Series(pd.Categorical.from_codes(new_codes, categories=categories),
+                     index=codes.index, name=codes.name)
+
+
+def is_excluded(codes, prefixes=EXCLUDED_PREFIXES):
+    """Masque des communes exclues de l'étude (Corse et outre-mer) pour une série de codes normalisés"""
+    excluded = np.append(codes.cat.categories.str.startswith(prefixes), False)
+    return excluded[codes.cat.codes.to_numpy()]
+
+
+def shared_keys(*codes):
+    """
+    Recode plusieurs séries de codes normalisés sur les mêmes catégories : pd.merge compare
+    alors les codes entiers des catégories plutôt que des chaînes Python
+    """
+    categories = codes[0].cat.categories
+    for c in codes[1:]:
+        categories = categories.union(c.cat.categories)
+    return [c.cat.set_categories(categories) for c in codes]
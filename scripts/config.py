@@ -14,6 +14,66 @@ RENAME_VILLES_FULL = {
     "Nb_campings_2022": "nb_campings_2022"
 }
 
+# Types des colonnes de la BDD des villes après renommage
+# (float32 suffit : effectifs < 2^24 et parts/taux à 1 décimale)
+SCHEMA_VILLES = {
+    "code_geo": "str",
+    "libelle": "str",
+    "part_commerce_transport_services_2023": "float32",
+    "population_2022": "float32",
+    "nb_etablissements_2023": "float32",
+    "densite_population_2022": "float32",
+    "taux_activite_2022": "float32",
+    "mediane_niveau_vie_2021": "float32",
+    "part_industrie_2023": "float32",
+    "part_construction_2023": "float32",
+    "nb_hotels_2022": "float32",
+    "nb_campings_2022": "float32"
+}
+
+# Préfixes des codes communes exclus de l'étude (Corse et outre-mer)
+EXCLUDED_PREFIXES = ("2A", "2B", "97")
+
+# Table de passage des codes communes (COG) vers le code utilisé pour la jointure :
+# arrondissements de Paris, Marseille et Lyon -> commune mère. D'autres évolutions du COG
+# (fusions de communes, ...) peuvent être ajoutées sous la forme ancien code -> nouveau code
+COG_MAPPING = {
+    **{str(code): "75056" for code in range(75101, 75121)},  # Paris : 75101 à 75120
+    **{str(code): "13055" for code in range(13201, 13217)},  # Marseille : 13201 à 13216
+    **{str(code): "69123" for code in range(69381, 69390)}   # Lyon : 69381 à 69389
+}
+
+# Variables explicatives des modèles : les 8 premières sont celles des arbres CART,
+# le LASSO y ajoute les données touristiques (ordre conservé dans le feature store)
+FEATURES_CART = [
+    "population_2022",
+    "mediane_niveau_vie_2021",
+    "densite_population_2022",
+    "part_commerce_transport_services_2023",
+    "part_industrie_2023",
+    "part_construction_2023",
+    "taux_activite_2022",
+    "nb_etablissements_2023"
+]
+FEATURES_LASSO = FEATURES_CART + ["nb_hotels_2022", "nb_campings_2022"]
+
+# Stratification des villes pour les statistiques descriptives : variable -> (bornes, libellés).
+# Les classes sont fermées à gauche : [0, 2000), [2000, 10000), ...
+STRATA = {
+    "population_2022": (
+        [0, 2000, 10000, 50000, float("inf")],
+        ["Rurale (<2k)", "Petite (2-10k)", "Moyenne (10-50k)", "Grande (>50k)"]
+    ),
+    "densite_population_2022": (
+        [0, 25, 300, 1500, float("inf")],
+        ["Peu dense (<25)", "Intermédiaire (25-300)", "Dense (300-1500)", "Très dense (>1500)"]
+    ),
+    "mediane_niveau_vie_2021": (
+        [0, 20000, 22500, 25000, float("inf")],
+        ["Modeste (<20k€)", "Médiane (20-22.5k€)", "Aisée (22.5-25k€)", "Très aisée (>25k€)"]
+    )
+}
+
 # Dictionnaire pour renommer les colonnes de la BDD Geodair
 RENAME_GEODAIR = {
     'Date de début': 'date_debut',
@@ -50,4 +110,20 @@ UNAVAILABLE_VALUES = [
     "N/A - résultat non disponible",
     "N/A - division par 0",
     "N/A - secret statistique"
-]
\ No newline at end of file
+]
+
+# Référentiel des communes (data.gouv.fr) utilisé pour le géocodage hors-ligne
+PATH_COMMUNES = "data/raw_data/20230823-communes-departement-region.csv"
+
+# Données brutes
+PATH_AIR = "data/raw_data/data_air_2022.csv"
+PATH_VILLES = "data/raw_data/data.csv"
+PATH_TOURISME = "data/raw_data/BDD_tourisme_communes_2022.csv"
+
+# Dictionnaire pour renommer les colonnes du référentiel des communes
+RENAME_COMMUNES = {
+    "code_commune_INSEE": "CODGEO",
+    "nom_commune_complet": "Ville",
+    "latitude": "Latitude_commune",
+    "longitude": "Longitude_commune"
+}
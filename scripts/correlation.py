@@ -0,0 +1,129 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+METHODS = ("pearson", "spearman")
+TARGETS = ("valeur", "valeur_brute")   # Colonnes propres à chaque polluant, ajoutées au bloc des variables des villes
+CACHE_SIZE = 32                        # Matrices conservées (les moins récemment utilisées sont évincées)
+
+# Matrices déjà calculées, indexées par (type de bloc, empreintes des données, méthode) (ordre LRU)
+_CORR = OrderedDict()
+
+
+def _block_hash(X, cols):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(X).tobytes())
+    h.update(str((X.shape, list(cols))).encode())
+    return h.hexdigest()
+
+
+def _prepare(df, cols, method):
+    """
+    Bloc float32 (n, p) des colonnes, NaN conservés, centré par colonne (meilleur conditionnement
+    des sommes de produits). Pour "spearman", valeurs float64 telles quelles (l'arrondi float32 créerait
+    des ex aequo), les rangs étant calculés ensuite par paire (_spearman).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Méthode inconnue : {method} (attendu : {', '.join(METHODS)})")
+    if method == "spearman":
+        return df[cols].to_numpy(dtype=np.float64)
+    X = df[cols].to_numpy(dtype=np.float32, copy=True)
+    if X.size:
+        with np.errstate(all="ignore"):
+            X -= np.nan_to_num(np.nanmean(X, axis=0))
+    return X
+
+
+def _pairwise(A, B):
+    """ Corrélations de Pearson par paires d'observations complètes entre les colonnes de A (n, p) et B (n, q) """
+    MA, MB = (~np.isnan(A)).astype(np.float64), (~np.isnan(B)).astype(np.float64)
+    A0, B0 = np.nan_to_num(A).astype(np.float64), np.nan_to_num(B).astype(np.float64)
+
+    n = MA.T @ MB
+    sa, sb = A0.T @ MB, MA.T @ B0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = A0.T @ B0 - sa * sb / n
+        var_a = (A0 ** 2).T @ MB - sa ** 2 / n
+        var_b = MA.T @ B0 ** 2 - sb ** 2 / n
+        r = cov / np.sqrt(var_a * var_b)
+    r[n < 2] = np.nan
+    return np.clip(r, -1, 1)
+
+
+def _ranks(X):
+    """ Rangs moyens par colonne (ex aequo : rang moyen), NaN conservés """
+    return pd.DataFrame(X).rank().to_numpy(dtype=np.float64)
+
+
+def _spearman(A, B):
+    """
+    Corrélations de Spearman par paires d'observations complètes, comme DataFrame.corr("spearman") :
+    les rangs de chaque paire sont calculés sur ses seules observations complètes. Les rangs par colonne
+    sont exacts pour les paires de mêmes valeurs manquantes; les autres paires sont reclassées une à une.
+    """
+    MA, MB = ~np.isnan(A), ~np.isnan(B)
+    r = _pairwise(_ranks(A), _ranks(B))
+
+    n = MA.T.astype(np.float64) @ MB
+    same = (n == MA.sum(axis=0)[:, None]) & (n == MB.sum(axis=0)[None, :])
+    for i, j in zip(*np.nonzero(~same & (n >= 2))):
+        rows = MA[:, i] & MB[:, j]
+        r[i, j] = _pairwise(_ranks(A[rows, i][:, None]), _ranks(B[rows, j][:, None]))[0, 0]
+    return r
+
+
+def _corr(A, B, method="pearson", chunk=None):
+    """ Corrélations entre A et B, par blocs de chunk colonnes si précisé (tableaux très larges) """
+    pairwise = _spearman if method == "spearman" else _pairwise
+    if chunk is None:
+        return pairwise(A, B)
+    r = np.empty((A.shape[1], B.shape[1]))
+    for i in range(0, A.shape[1], chunk):
+        for j in range(0, B.shape[1], chunk):
+            r[i:i + chunk, j:j + chunk] = pairwise(A[:, i:i + chunk], B[:, j:j + chunk])
+    return r
+
+
+def _cached(key, compute):
+    if key in _CORR:
+        _CORR.move_to_end(key)
+        return _CORR[key]
+    value = _CORR[key] = compute()
+    if len(_CORR) > CACHE_SIZE:
+        _CORR.popitem(last=False)
+    return value
+
+
+def correlation_matrix(df, cols=None, method="pearson", targets=TARGETS, reference=None, chunk=None):
+    """
+    Matrice des corrélations (pearson ou spearman) par paires d'observations complètes, comme df[cols].corr().
+    Les colonnes de targets (mesures du polluant) sont séparées des variables des villes :
+    - reference=None : le bloc variables x variables est calculé sur les lignes de df (exact pour cet
+      échantillon; il n'est réutilisé que si les mêmes lignes reviennent);
+    - reference : dataframe commun des villes (par exemple df_villes_clean). Le bloc variables x variables
+      est calculé une seule fois sur reference, mémorisé par empreinte de ses données quel que soit le
+      polluant, et seules les lignes des cibles sont calculées sur df. Ce bloc décrit alors la population
+      de reference, et non l'échantillon du polluant.
+    chunk : nombre de colonnes par bloc pour les tableaux larges (plusieurs centaines d'indicateurs INSEE);
+    il ne limite que la mémoire et ne modifie pas les résultats, d'où son absence de la clé du cache.
+    Pour "spearman", les rangs de chaque paire sont calculés sur ses observations complètes, comme
+    DataFrame.corr("spearman"). Au plus CACHE_SIZE blocs et matrices sont mémorisés.
+    """
+    cols = list(df.select_dtypes(include=[np.number]).columns if cols is None else cols)
+    target_cols = [c for c in cols if c in targets]
+    features = [c for c in cols if c not in targets]
+
+    F = _prepare(df, features, method)
+    T = _prepare(df, target_cols, method)
+    F_ref = F if reference is None else _prepare(reference, features, method)
+    key_f, key_ref, key_t = _block_hash(F, features), _block_hash(F_ref, features), _block_hash(T, target_cols)
+
+    def compute():
+        ff = _cached(("variables", key_ref, method), lambda: _corr(F_ref, F_ref, method, chunk))
+        ft = _corr(F, T, method, chunk)
+        tt = _corr(T, T, method, chunk)
+        full = np.block([[ff, ft], [ft.T, tt]])
+        return pd.DataFrame(full, index=features + target_cols, columns=features + target_cols)
+
+    return _cached(("matrice", key_ref, key_f, key_t, method), compute).loc[cols, cols]
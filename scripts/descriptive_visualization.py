@@ -1,7 +1,8 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-import os
+from functools import partial
+from scripts import correlation, profiling, rendering
 
 
 def setup_styles():
@@ -10,13 +11,26 @@ def setup_styles():
     sns.set_theme(style="whitegrid")
 
 
-def plot_distributions(df, cols, display=False, output_dir="output/Desc_All_Cities"):
-    """Affichage d'histogramme des colonnes spécifiées"""
-    os.makedirs(output_dir, exist_ok=True)
-
+def _distribution_spec(data, col, log_scale, echelle_suffix, path):
+    """Histogramme (effectifs) d'une colonne"""
+    t = rendering.to_scale(data, log_scale)
+    edges = np.histogram_bin_edges(t, bins="auto")
+    return {
+        "path": path, "figsize": (9, 5), "log_scale": log_scale,
+        "layers": [{"kind": "hist", "values": np.histogram(t, edges)[0],
+                    "edges": rendering.from_scale(edges, log_scale),
+                    "style": {"fill": True, "color": "teal", "alpha": 0.75}}],
+        "title": f'Distribution de {col} {echelle_suffix}',
+        "tight_layout": True, "savefig": {"dpi": 300}
+    }
+
+
+@profiling.timed()
+def plot_distributions(df, cols, display=False, output_dir="output/Desc_All_Cities", n_jobs=-1):
+    """Affichage d'histogramme des colonnes spécifiées (seules les figures dont les données ont changé sont retracées)"""
+    figures = []
     for col in cols:
-        plt.figure(figsize=(9, 5))
-        data = df[col].dropna()
+        data = df[col].dropna().to_numpy(dtype=np.float64)
 
         # Utilisation d'une échelle log
         if col not in ["nb_campings_2022", "nb_hotels_2022"]:
@@ -27,26 +41,27 @@ def plot_distributions(df, cols, display=False, output_dir="output/Desc_All_Citi
             log_scale = False
             echelle_suffix = "(Échelle Linéaire)"
 
-        sns.histplot(
-            data, 
-            kde=False,
-            log_scale=log_scale,
-            color="teal"
-        )
+        path = f"{output_dir}/hist_{col}.png"
+        figures.append({
+            "path": path, "key": rendering.data_hash(data, "hist", col, log_scale),
+            "build": partial(_distribution_spec, data, col, log_scale, echelle_suffix, path)
+        })
 
-        plt.title(f'Distribution de {col} {echelle_suffix}')
-        plt.tight_layout()
-        plt.savefig(f"{output_dir}/hist_{col}.png", dpi=300)
-        if display:
-            plt.show()
-        plt.close()
+    rendering.render_figures(figures, output_dir, n_jobs)
+    if display:
+        rendering.show_figures([fig["path"] for fig in figures])
 
 
-def plot_correlation_heatmap(df, output_dir="output/Desc_All_Cities", display=False, pol=None):
-    """Génère et sauvegarde une matrice des corrélations"""
-    # On ne garde que les colonnes numériques
-    cols_corr = df.select_dtypes(include=[np.number]).columns
-    corr_matrix = df[cols_corr].corr()
+@profiling.timed()
+def plot_correlation_heatmap(df, output_dir="output/Desc_All_Cities", display=False, pol=None, method="pearson",
+                             corr_matrix=None, reference=None):
+    """
+    Génère et sauvegarde une matrice des corrélations des colonnes numériques
+    (corr_matrix : matrice déjà calculée, sinon scripts.correlation.correlation_matrix, avec le bloc
+    des variables des villes calculé une fois sur reference si fourni)
+    """
+    if corr_matrix is None:
+        corr_matrix = correlation.correlation_matrix(df, method=method, reference=reference)
 
     plt.figure(figsize=(14, 12))
     cmap = sns.diverging_palette(240, 10, as_cmap=True)
@@ -64,45 +79,93 @@ def plot_correlation_heatmap(df, output_dir="output/Desc_All_Cities", display=Fa
     plt.close()
 
 
-def plot_comparative_distributions(df_sample, df_france, polluant_name, vars_eco, output_dir="output/plots_comparaison"):
+def _is_log(var):
+    return "population" in var.lower() or "densite" in var.lower()
+
+
+def _comparative_spec(layers, data_sample, polluant_name, var, path):
+    """France entière (couches précalculées) et échantillon d'un polluant : histogrammes de densité et KDE"""
+    log_scale = layers["log_scale"]
+    t = rendering.to_scale(data_sample, log_scale)
+    x = rendering.from_scale(layers["grid"], log_scale)
+    return {
+        "path": path, "figsize": (10, 6), "log_scale": log_scale,
+        "layers": [
+            # Plot France
+            {"kind": "hist", "values": layers["density"], "edges": rendering.from_scale(layers["edges"], log_scale),
+             "style": {"fill": True, "color": "lightgray", "alpha": 0.5, "label": "France entière"}},
+            {"kind": "line", "x": x, "y": layers["kde"], "style": {"color": "lightgray"}},
+            # Plot échantillon
+            {"kind": "hist", "values": np.histogram(t, layers["sample_edges"], density=True)[0],
+             "edges": rendering.from_scale(layers["sample_edges"], log_scale),
+             "style": {"fill": True, "color": "teal", "alpha": 0.6, "label": f"Échantillon ({polluant_name})"}},
+            {"kind": "line", "x": x, "y": rendering.kde(t, layers["grid"]), "style": {"color": "teal"}},
+            # Affichage des moyennes
+            {"kind": "vline", "x": layers["mean"], "style": {"color": "gray", "linestyle": "--", "label": "Moyenne FR"}},
+            {"kind": "vline", "x": float(np.mean(data_sample)),
+             "style": {"color": "teal", "linestyle": "-", "label": "Moyenne Éch"}}
+        ],
+        "title": f"Distribution : {var} ({polluant_name})", "legend": True,
+        "savefig": {"bbox_inches": "tight"}
+    }
+
+
+@profiling.timed()
+def plot_comparative_distributions(df_sample, df_france, polluant_name, vars_eco, output_dir="output/plots_comparaison",
+                                   n_jobs=-1):
     """
     Génère un graphique comparant les distributions de certaines colonnes pour
-    toutes les villes de France et celles de nos échantillons
+    toutes les villes de France et celles de nos échantillons.
+    Les classes et la KDE de la France entière sont calculées une fois par variable pour tous les polluants,
+    et seules les figures dont les données ont changé sont retracées.
     """
-    os.makedirs(output_dir, exist_ok=True)
-
+    figures = []
     for var in vars_eco:
         if var not in df_france.columns or var not in df_sample.columns:
             continue
 
-        data_france = df_france[var].dropna()
-        data_sample = df_sample[var].dropna()
-
-        plt.figure(figsize=(10, 6))
-
-        log_scale = True if ("population" in var.lower() or "densite" in var.lower()) else False
-
-        # Plot France
-        sns.histplot(data_france, stat="density", kde=True, color="lightgray",
-                     label="France entière", log_scale=log_scale, alpha=0.5)
-
-        # Plot échantillon
-        sns.histplot(data_sample, stat="density", kde=True, color="teal",
-                     label=f"Échantillon ({polluant_name})", log_scale=log_scale, alpha=0.6)
-
-        # Affichage des moyennes
-        plt.axvline(data_france.mean(), color='gray', linestyle='--', label=f"Moyenne FR")
-        plt.axvline(data_sample.mean(), color='teal', linestyle='-', label=f"Moyenne Éch")
-
-        plt.title(f"Distribution : {var} ({polluant_name})")
-        plt.legend()
-
-        filename = f"{output_dir}/Distr_{polluant_name}_{var}.png"
-        plt.savefig(filename, bbox_inches='tight')
-        plt.close()
-
-
-def plot_combined_distributions_per_var(samples_dict, df_france, vars_eco, output_dir="output/plots_comparaison"):
+        data_france = df_france[var].dropna().to_numpy(dtype=np.float64)
+        data_sample = df_sample[var].dropna().to_numpy(dtype=np.float64)
+        layers = rendering.variable_layers(var, data_france, _is_log(var))
+
+        path = f"{output_dir}/Distr_{polluant_name}_{var}.png"
+        figures.append({
+            "path": path, "key": rendering.data_hash(data_france, data_sample, "comparative", polluant_name, var),
+            "build": partial(_comparative_spec, layers, data_sample, polluant_name, var, path)
+        })
+
+    rendering.render_figures(figures, output_dir, n_jobs)
+
+
+def _combined_spec(layers, samples, var, path):
+    """France entière (histogramme de fond) et courbe KDE de chaque polluant"""
+    log_scale = layers["log_scale"]
+    x = rendering.from_scale(layers["grid"], log_scale)
+    figure_layers = [
+        # On utilise une densité pour que l'échelle soit comparable aux courbes KDE
+        {"kind": "hist", "values": layers["density"], "edges": rendering.from_scale(layers["edges"], log_scale),
+         "style": {"fill": False, "color": "lightgray", "alpha": 0.4, "label": "France entière (Ref)"}},
+        {"kind": "vline", "x": layers["mean"],
+         "style": {"color": "gray", "linestyle": ":", "linewidth": 1, "alpha": 0.8}}
+    ]
+    for polluant_name, data_sample, color in samples:
+        figure_layers += [
+            {"kind": "line", "x": x, "y": rendering.kde(rendering.to_scale(data_sample, log_scale), layers["grid"]),
+             "style": {"color": color, "label": polluant_name, "linewidth": 2}},
+            {"kind": "vline", "x": float(np.mean(data_sample)),
+             "style": {"color": color, "linestyle": "--", "linewidth": 1.5, "alpha": 0.7}}
+        ]
+    return {
+        "path": path, "figsize": (12, 7), "log_scale": log_scale, "layers": figure_layers,
+        "title": f"Distribution comparative : {var}", "title_size": 14, "xlabel": var, "ylabel": "Densité",
+        "legend": True, "legend_title": "Populations", "grid": True,
+        "savefig": {"bbox_inches": "tight", "dpi": 100}
+    }
+
+
+@profiling.timed()
+def plot_combined_distributions_per_var(samples_dict, df_france, vars_eco, output_dir="output/plots_comparaison",
+                                        n_jobs=-1):
     """
     Génère un graphique par variable. Chaque graphique contient :
     - La distribution de la France entière (fond gris).
@@ -111,59 +174,36 @@ def plot_combined_distributions_per_var(samples_dict, df_france, vars_eco, outpu
     Args:
         samples_dict (dict): Dictionnaire { "Nom_Polluant": df_sample }
         df_france (pd.DataFrame): DataFrame de référence (France entière)
-        vars_eco (list): Liste des colonnes à tracer
+        vars_eco (dict): Colonnes à tracer -> affichage ou non dans le notebook
         output_dir (str): Dossier de sortie
+        n_jobs (int): Nombre de processus de rendu
     """
-    os.makedirs(output_dir, exist_ok=True)
-
     # Définition d'une palette de couleurs pour les polluants
-    # "viridis", "deep", ou une liste manuelle de couleurs
     palette = sns.color_palette("viridis", n_colors=len(samples_dict))
 
+    figures = []
     for var in vars_eco.keys():
-        # Nettoyage données France
-        data_france = df_france[var].dropna()
-        plt.figure(figsize=(12, 7))
-        # Détection échelle log
-        is_log = True if ("population" in var.lower() or "densite" in var.lower()) else False
-
-        # --- 1. Plot France (Histogramme de fond) ---
-        # On utilise stat="density" pour que l'échelle soit comparable aux courbes KDE
-        sns.histplot(data_france, stat="density", kde=False, color="lightgray", 
-                     label="France entière (Ref)", log_scale=is_log, alpha=0.4, element="step")
-        
-        # Ajout moyenne France (ligne verticale discrète)
-        plt.axvline(data_france.mean(), color='gray', linestyle=':', linewidth=1, alpha=0.8)
-
-        # --- 2. Boucle sur les polluants (Courbes KDE seulement) ---
+        data_france = df_france[var].dropna().to_numpy(dtype=np.float64)
+        layers = rendering.variable_layers(var, data_france, _is_log(var))
+
+        samples = []
         for i, (polluant_name, df_sample) in enumerate(samples_dict.items()):
             if var not in df_sample.columns:
                 continue
-                
-            data_sample = df_sample[var].dropna()
-            if data_sample.empty:
+            data_sample = df_sample[var].dropna().to_numpy(dtype=np.float64)
+            if len(data_sample) == 0:
                 continue
-            
-            color = palette[i]
-            
-            # On utilise kdeplot (courbe) au lieu de histplot pour éviter le chaos visuel
-            sns.kdeplot(data_sample, color=color, label=polluant_name, 
-                        log_scale=is_log, linewidth=2, warn_singular=False)
-            
-            # Optionnel : Ajouter un marqueur pour la moyenne sur l'axe X ou une petite ligne
-            plt.axvline(data_sample.mean(), color=color, linestyle='--', linewidth=1.5, alpha=0.7)
-
-        # Finalisation du graphique
-        plt.title(f"Distribution comparative : {var}", fontsize=14)
-        plt.xlabel(var)
-        plt.ylabel("Densité")
-        plt.legend(title="Populations")
-        plt.grid(True, which="both", linestyle="--", linewidth=0.5, alpha=0.5)
-
-        filename = f"{output_dir}/Combined_Distr_{var}.png"
-        plt.savefig(filename, bbox_inches='tight', dpi=100)
-        if vars_eco[var]:
-            plt.show()
-        plt.close()
-
-    print(f"Graphiques générés dans : {output_dir}")
\ No newline at end of file
+            samples.append((polluant_name, data_sample, tuple(palette[i])))
+
+        path = f"{output_dir}/Combined_Distr_{var}.png"
+        figures.append({
+            "path": path,
+            "key": rendering.data_hash(data_france, *[d for _, d, _ in samples], "combined", var,
+                                       [(name, color) for name, _, color in samples]),
+            "build": partial(_combined_spec, layers, samples, var, path)
+        })
+
+    rendering.render_figures(figures, output_dir, n_jobs)
+    rendering.show_figures([fig["path"] for fig, var in zip(figures, vars_eco) if vars_eco[var]])
+
+    print(f"Graphiques générés dans : {output_dir}")
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from scripts import ingest
+from scripts.config import FEATURES_LASSO
+
+STORE_DIR = "data/cache/features"
+STORE_VERSION = 1
+FEATURES = FEATURES_LASSO
+TARGETS = ["valeur", "valeur_brute"]
+ID_COLS = ["ville", "codgeo"]
+
+
+class FeatureMatrix:
+
+    """
+    Matrice des variables explicatives d'un polluant, construite une seule fois :
+    - X_raw : bloc (n, p) float64 avec les valeurs manquantes, X : même bloc imputé par les médianes
+      (stockées dans medians), tous deux en ordre colonne pour que les sous-blocs de colonnes
+      contiguës soient des vues;
+    - targets : cibles (valeur, valeur_brute) alignées sur les lignes de X.
+    Les modèles reçoivent des vues (view, frame) plutôt que des dataframes reconstruits.
+    """
+
+    def __init__(self, pol, X_raw, targets, medians, features=FEATURES, ids=None):
+        self.pol = pol
+        self.features = list(features)
+        self.X_raw = np.asfortranarray(X_raw, dtype=np.float64)
+        self.medians = np.asarray(medians, dtype=np.float64)
+        self.missing = np.isnan(self.X_raw)
+        self.X = np.asfortranarray(np.where(self.missing, self.medians, self.X_raw))
+        self.targets = targets
+        self.ids = ids
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def _columns(self, features):
+        idx = [self.features.index(f) for f in features]
+        if idx == list(range(idx[0], idx[0] + len(idx))):
+            return slice(idx[0], idx[0] + len(idx))
+        return idx
+
+    def view(self, features=None, imputed=True):
+        """Bloc (n, p) des variables demandées : vue sans copie si elles sont contiguës dans le stockage"""
+        X = self.X if imputed else self.X_raw
+        return X if features is None else X[:, self._columns(features)]
+
+    def frame(self, features=None, imputed=True):
+        """Dataframe adossé à view() (sans copie des données)"""
+        features = self.features if features is None else list(features)
+        return pd.DataFrame(self.view(features, imputed), columns=features, copy=False)
+
+    def target(self, name="valeur"):
+        return self.targets[name]
+
+    def complete_rows(self, features=None, target="valeur_brute"):
+        """Masque des lignes sans valeur manquante, ni dans les variables demandées ni dans la cible"""
+        return ~np.isnan(self.view(features, imputed=False)).any(axis=1) & ~np.isnan(self.targets[target])
+
+
+def _matrix(pol, df, features, medians=None):
+    """FeatureMatrix d'un polluant à partir de son extrait de l'agrégat"""
+    X_raw = df[features].to_numpy(dtype=np.float64)
+    if medians is None:
+        medians = df[features].median().to_numpy(dtype=np.float64)
+    targets = {t: df[t].to_numpy(dtype=np.float64) for t in TARGETS if t in df.columns}
+    ids = df[[c for c in ID_COLS if c in df.columns]].reset_index(drop=True)
+    return FeatureMatrix(pol, X_raw, targets, medians, features, ids)
+
+
+def _store_key(df, features):
+    """Empreinte du contenu de l'agrégat, des variables retenues et de la version du format"""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(json.dumps({"version": STORE_VERSION, "features": features}).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _file_name(pol):
+    return re.sub(r"[^0-9A-Za-z]+", "_", pol).strip("_") + ".feather"
+
+
+def build_feature_store(df_groupe, store_dir=STORE_DIR, features=FEATURES):
+    """
+    Matérialise une fois, pour chaque polluant de la sortie de aggregate_by_pollutant, le bloc des
+    variables explicatives, les cibles et les médianes d'imputation. Le répertoire est versionné
+    par l'empreinte des données et des variables : un agrégat inchangé est simplement relu.
+    Retourne un dictionnaire polluant -> FeatureMatrix.
+    """
+    cols = ["polluant"] + [c for c in ID_COLS + TARGETS if c in df_groupe.columns] + list(features)
+    df = df_groupe[cols]
+
+    if ingest.feather is None:
+        return {pol: _matrix(pol, sub, features) for pol, sub in df.groupby("polluant", sort=True)}
+
+    path = os.path.join(store_dir, f"v{STORE_VERSION}-{_store_key(df, features)}")
+    if not os.path.exists(os.path.join(path, "manifest.json")):
+        manifest = {"version": STORE_VERSION, "features": list(features), "pollutants": {}}
+        for pol, sub in df.groupby("polluant", sort=True):
+            sub = sub.drop(columns="polluant").astype({c: np.float64 for c in features})
+            if "codgeo" in sub.columns:
+                sub["codgeo"] = sub["codgeo"].astype(object)
+            ingest.write_table(sub, os.path.join(path, _file_name(pol)))
+            manifest["pollutants"][pol] = {
+                "file": _file_name(pol),
+                "medians": sub[features].median().tolist()
+            }
+        # Le manifeste est écrit en dernier : sa présence garantit que le stockage est complet
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    return load_feature_store(path)
+
+
+def load_feature_store(path):
+    """Relit un stockage écrit par build_feature_store"""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    features = manifest["features"]
+    return {
+        pol: _matrix(pol, ingest.read_table(os.path.join(path, entry["file"])), features, entry["medians"])
+        for pol, entry in manifest["pollutants"].items()
+    }
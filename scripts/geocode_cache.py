@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import time
+
+PATH_CACHE = "data/cache/geocode_cache.sqlite"
+PRECISION = 5                  # ~1 m en latitude
+TTL_SEC = 180 * 24 * 3600      # Durée de vie d'un résultat trouvé
+FAILURE_TTL_SEC = 24 * 3600    # Durée de vie d'un échec (None, None)
+MAX_ENTRIES = 100_000
+COMMIT_EVERY = 100             # Écritures (insertions et dates d'accès) par transaction
+EVICT_EVERY = 1000             # Insertions entre deux évictions
+
+
+class GeocodeCache:
+
+    """
+    Cache persistant (SQLite) des résultats de reverse_insee, indexé par (lat, lon) arrondis.
+    - chaque entrée expire après ttl secondes (failure_ttl pour les échecs, afin de ne pas
+      mémoriser indéfiniment une erreur transitoire de l'API);
+    - la taille est bornée à max_entries, les entrées les moins récemment utilisées sont évincées
+      toutes les evict_every insertions (et à la fermeture après des insertions) : la table peut
+      dépasser temporairement max_entries d'au plus evict_every entrées;
+    - les écritures sont validées par transactions de commit_every (flush() ou close() valident le reste);
+    - les compteurs hits / misses permettent de suivre l'efficacité du cache.
+    """
+
+    def __init__(self, path=PATH_CACHE, ttl=TTL_SEC, failure_ttl=FAILURE_TTL_SEC,
+                 max_entries=MAX_ENTRIES, precision=PRECISION, commit_every=COMMIT_EVERY,
+                 evict_every=EVICT_EVERY):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.commit_every = commit_every
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._inserts = 0
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " lat REAL NOT NULL, lon REAL NOT NULL,"
+            " city TEXT, code_insee TEXT,"
+            " created REAL NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (lat, lon))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON geocode (last_access)")
+        self._conn.commit()
+
+    def _key(self, lat, lon):
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+    def get(self, lat, lon):
+        """Retourne (city, code_insee) si présent et non expiré, sinon None."""
+        key = self._key(lat, lon)
+        row = self._conn.execute(
+            "SELECT city, code_insee, created FROM geocode WHERE lat = ? AND lon = ?", key
+        ).fetchone()
+
+        now = time.time()
+        if row is not None:
+            city, code_insee, created = row
+            ttl = self.ttl if code_insee is not None else self.failure_ttl
+            if now - created <= ttl:
+                self._conn.execute(
+                    "UPDATE geocode SET last_access = ? WHERE lat = ? AND lon = ?", (now, *key)
+                )
+                self._written()
+                self.hits += 1
+                return city, code_insee
+
+        self.misses += 1
+        return None
+
+    def set(self, lat, lon, city, code_insee):
+        """Enregistre un résultat (les échecs sont stockés avec failure_ttl)."""
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)",
+            (*self._key(lat, lon), city, code_insee, now, now)
+        )
+        self._inserts += 1
+        if self._inserts % self.evict_every == 0:
+            self._evict()
+        self._written()
+
+    def _written(self):
+        """Valide la transaction en cours toutes les commit_every écritures."""
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """Valide les écritures en attente."""
+        self._conn.commit()
+        self._pending = 0
+
+    def _evict(self):
+        """Supprime les entrées expirées, puis les moins récemment utilisées au-delà de max_entries."""
+        now = time.time()
+        self._conn.execute(
+            "DELETE FROM geocode WHERE (code_insee IS NOT NULL AND created < ?)"
+            " OR (code_insee IS NULL AND created < ?)",
+            (now - self.ttl, now - self.failure_ttl)
+        )
+        n = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        if n > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM geocode WHERE rowid IN"
+                " (SELECT rowid FROM geocode ORDER BY last_access LIMIT ?)",
+                (n - self.max_entries,)
+            )
+
+    def stats(self):
+        """Compteurs d'utilisation du cache."""
+        n = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": n,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        if self._inserts % self.evict_every:
+            self._evict()
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
@@ -0,0 +1,147 @@
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = "https://api-adresse.data.gouv.fr"
+HEADERS = {"User-Agent": "geodair-geocoder"}
+RATE_LIMIT = 40          # Requêtes par seconde (l'API tolère 50 req/s par IP)
+MAX_WORKERS = 8          # Requêtes simultanées
+MAX_RETRIES = 4
+BACKOFF_SEC = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+
+    """
+    Limiteur de débit par seau à jetons, partagé entre les threads :
+    au plus `rate` requêtes par seconde en régime établi, avec des rafales de `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloque jusqu'à ce qu'un jeton soit disponible, puis le consomme."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class GeocodingClient:
+
+    """
+    Client concurrent de l'API de géocodage inverse de data.gouv.fr :
+    - une seule session HTTP avec un pool de connexions réutilisées;
+    - un débit limité par un TokenBucket plutôt que par une pause fixe;
+    - des relances avec attente exponentielle sur les réponses 429 et 5xx;
+    - max_workers requêtes en vol simultanément;
+    - optionnellement, l'endpoint /reverse/csv/ pour géocoder tous les points en un seul envoi.
+    base_url permet de cibler un serveur local (tests, miroir interne, cf. benchmark.bench_geocoding).
+    S'utilise comme gestionnaire de contexte (with) pour fermer la session.
+    """
+
+    def __init__(self, base_url=BASE_URL, rate=RATE_LIMIT, max_workers=MAX_WORKERS,
+                 max_retries=MAX_RETRIES, backoff=BACKOFF_SEC, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method, path, **kwargs):
+        """Requête HTTP limitée en débit, relancée sur 429 / 5xx et erreurs réseau."""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                r = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            except requests.RequestException:
+                r = None
+
+            if r is not None and r.status_code not in RETRY_STATUS:
+                r.raise_for_status()
+                return r
+
+            if attempt == self.max_retries:
+                break
+
+            # On respecte l'en-tête Retry-After s'il est fourni par le serveur
+            retry_after = r.headers.get("Retry-After") if r is not None else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff * 2 ** attempt
+            time.sleep(delay)
+
+        if r is not None:
+            r.raise_for_status()
+        raise requests.ConnectionError(f"Échec de la requête {method} {path}")
+
+    def reverse(self, lat, lon):
+        """Commune et code INSEE des coordonnées sur la session partagée : retourne (city, code_insee)."""
+        try:
+            data = self._request("GET", "/reverse", params={"lat": lat, "lon": lon}).json()
+        except Exception:
+            return None, None
+
+        feats = data.get("features", [])
+        if not feats:
+            return None, None
+
+        props = feats[0].get("properties", {})
+        return props.get("city"), props.get("citycode")
+
+    def reverse_many(self, coords):
+        """Géocode une liste de (lat, lon) avec max_workers requêtes en parallèle, dans l'ordre d'entrée."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(lambda c: self.reverse(*c), coords))
+
+    def reverse_csv(self, coords):
+        """Géocode une liste de (lat, lon) en un seul appel à l'endpoint /reverse/csv/."""
+        if len(coords) == 0:
+            return []
+
+        buffer = io.StringIO()
+        pd.DataFrame(coords, columns=["lat", "lon"]).to_csv(buffer, index=False)
+        try:
+            r = self._request(
+                "POST", "/reverse/csv/",
+                files={"data": ("coords.csv", buffer.getvalue(), "text/csv")}
+            )
+            res = pd.read_csv(io.StringIO(r.text), dtype={"result_citycode": str})
+        except Exception:
+            return [(None, None)] * len(coords)
+
+        res = res.astype(object).where(res.notna(), None)
+        return list(zip(res["result_city"], res["result_citycode"]))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+import hashlib
+import inspect
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow absent : on se rabat sur la lecture CSV
+    feather = None
+
+CACHE_DIR = "data/cache/ingest"
+# À incrémenter si le format des tables en cache change indépendamment du code des constructeurs
+CACHE_VERSION = 1
+
+# Empreintes déjà calculées, indexées par (chemin, date de modification, taille)
+_HASHES = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Empreinte (blake2b) du contenu d'un fichier, mémorisée tant qu'il n'est pas modifié"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _HASHES:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        _HASHES[key] = h.hexdigest()
+    return _HASHES[key]
+
+
+def _params_hash(params):
+    """Empreinte des paramètres de lecture (dtypes, séparateur, ...)"""
+    return hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+def write_table(df, path):
+    """Écrit un dataframe au format Feather (Arrow IPC, non compressé pour permettre le memory-mapping)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    df.reset_index(drop=True).to_feather(tmp, compression="uncompressed")
+    os.replace(tmp, path)
+
+
+def read_table(path, columns=None):
+    """Lit un fichier Feather en memory-mapping, en ne chargeant que les colonnes demandées"""
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def read_csv_cached(path, columns=None, cache_dir=CACHE_DIR, **read_csv_kwargs):
+    """
+    Équivalent de pd.read_csv(path, **read_csv_kwargs)[columns] : le CSV est converti une seule fois
+    en Feather typé dans cache_dir. Le cache est invalidé par l'empreinte du contenu du fichier
+    et des paramètres de lecture; les lectures suivantes sont memory-mappées.
+    """
+    if feather is None:
+        df = pd.read_csv(path, **read_csv_kwargs)
+        return df[columns] if columns is not None else df
+
+    key = file_hash(path) + "-" + _params_hash(read_csv_kwargs)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}-{key}.feather")
+
+    if not os.path.exists(cache_path):
+        write_table(pd.read_csv(path, **read_csv_kwargs), cache_path)
+
+    return read_table(cache_path, columns=columns)
+
+
+def _code_hash(code):
+    """Empreinte du source des modules qui définissent les fonctions (ou modules) de code"""
+    h = hashlib.blake2b(digest_size=8)
+    for path in sorted({inspect.getsourcefile(inspect.getmodule(obj)) for obj in code}):
+        h.update(file_hash(path).encode())
+    return h.hexdigest()
+
+
+def cached_frame(name, sources, build, params=None, cache_dir=CACHE_DIR, columns=None, code=()):
+    """
+    Mémorise sur disque le dataframe produit par build() (par exemple une table déjà nettoyée et typée).
+    Le cache est invalidé si le contenu d'un des fichiers sources, les paramètres, CACHE_VERSION ou le
+    source du module de build (et de ceux des fonctions ou modules de code, appelés par build) changent.
+    """
+    if feather is None:
+        df = build()
+        return df[columns] if columns is not None else df
+
+    h = hashlib.blake2b(digest_size=16)
+    for source in sources:
+        h.update(file_hash(source).encode())
+    h.update(_params_hash(params or {}).encode())
+    h.update(f"{CACHE_VERSION}-{_code_hash([build, *code])}".encode())
+    cache_path = os.path.join(cache_dir, f"{name}-{h.hexdigest()}.feather")
+
+    if not os.path.exists(cache_path):
+        write_table(build(), cache_path)
+
+    return read_table(cache_path, columns=columns)
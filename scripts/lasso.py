@@ -1,21 +1,40 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sklearn.model_selection import KFold
 from sklearn.pipeline import Pipeline
 import statsmodels.api as sm
+from scripts.config import FEATURES_LASSO
+from scripts import profiling
+from scripts.feature_store import FeatureMatrix
 
+ALPHAS = np.array([0.001, 0.01, 0.02, 0.025, 0.05, 0.1, 0.25, 0.5, 0.8, 1.0])
+CV_FOLDS = 5
+TOL = 1e-6
+MAX_ITER = 1000
 
+
+@profiling.timed()
 def lasso_select_and_OLS(df_pol, lasso_pipeline):
 
     """
     Prend en argument un dataframe de pollution contenant une colonne 'valeur brute'
-    et les 10 variables explicatives considérées dans notre étude, ainsi qu'un pipeline lasso,
+    et les 10 variables explicatives considérées dans notre étude (ou la FeatureMatrix
+    du polluant issue de scripts.feature_store), ainsi qu'un pipeline lasso,
     et affiche les variables sélectionnées, ainsi que les caractéristiques de la régression OLS 
     sur ces variables.
     """
 
-    y_train = df_pol['valeur_brute']
-    X_train = df_pol[['population_2022', 'mediane_niveau_vie_2021', 'densite_population_2022',
-        'part_commerce_transport_services_2023', 'part_industrie_2023',
-        'nb_hotels_2022', 'nb_etablissements_2023', 'taux_activite_2022',
-        'part_construction_2023', 'nb_campings_2022']]
+    if isinstance(df_pol, FeatureMatrix):
+        # Matrice du feature store : lignes complètes uniquement (équivalent du dropna)
+        rows = df_pol.complete_rows(FEATURES_LASSO, 'valeur_brute')
+        X_train = df_pol.frame(FEATURES_LASSO, imputed=False)
+        y_train = pd.Series(df_pol.target('valeur_brute'), name='valeur_brute')
+        if not rows.all():
+            X_train, y_train = X_train[rows], y_train[rows]
+    else:
+        y_train = df_pol['valeur_brute']
+        X_train = df_pol[FEATURES_LASSO]
 
     lasso_optimal = lasso_pipeline.fit(X_train, y_train)
 
@@ -32,4 +51,131 @@ def lasso_select_and_OLS(df_pol, lasso_pipeline):
         print(model_sm.get_robustcov_results().summary())
 
     else:
-        print("Aucune variable explicative sélectionnée.")
\ No newline at end of file
+        print("Aucune variable explicative sélectionnée.")
+
+
+def _lasso_path_gram(G, Xy, n, alphas, B=None, tol=TOL, max_iter=MAX_ITER):
+    """
+    Descente de coordonnées sur la forme covariance du LASSO (G = X'X, Xy = X'y, données centrées),
+    pour toutes les cibles (colonnes de Xy) à la fois, le long des alphas décroissants : chaque
+    solution sert de point de départ à la suivante. Retourne les coefficients (n_alphas, p, n_cibles).
+    """
+    p, n_targets = Xy.shape
+    B = np.zeros((p, n_targets)) if B is None else B.copy()
+    diag = np.diag(G)
+    coefs = np.empty((len(alphas), p, n_targets))
+
+    for k, alpha in enumerate(alphas):
+        threshold = n * alpha
+        for _ in range(max_iter):
+            max_delta = 0.0
+            for j in range(p):
+                if diag[j] == 0:
+                    continue
+                rho = Xy[j] - G[j] @ B + diag[j] * B[j]
+                new = np.sign(rho) * np.maximum(np.abs(rho) - threshold, 0.0) / diag[j]
+                max_delta = max(max_delta, np.abs(new - B[j]).max())
+                B[j] = new
+            if max_delta <= tol * max(1.0, np.abs(B).max()):
+                break
+        coefs[k] = B
+
+    return coefs
+
+
+def _robust_ols(X, y, names):
+    """ OLS avec constante et écarts-types robustes HC1 (comme get_robustcov_results de statsmodels) """
+    X = np.column_stack([np.ones(len(X)), X])
+    n, k = X.shape
+    bread = np.linalg.pinv(X.T @ X)
+    beta = bread @ (X.T @ y)
+    resid = y - X @ beta
+    meat = (X * resid[:, None] ** 2).T @ X
+    cov = bread @ meat @ bread * n / (n - k)
+
+    se = np.sqrt(np.diag(cov))
+    t = beta / se
+    table = pd.DataFrame({
+        "coef": beta,
+        "robust_se": se,
+        "t": t,
+        "p_value": 2 * stats.t.sf(np.abs(t), n - k)
+    }, index=["const"] + list(names))
+    r2 = 1 - resid @ resid / ((y - y.mean()) @ (y - y.mean()))
+    return table, r2
+
+
+@profiling.timed()
+def lasso_select_many(store, targets=("valeur_brute",), alphas=ALPHAS, features=FEATURES_LASSO, cv=CV_FOLDS):
+    """
+    Équivalent groupé de lasso_select_and_OLS (StandardScaler + LassoCV puis OLS robuste) pour toutes les
+    matrices d'un feature store (polluant -> FeatureMatrix) et toutes les cibles demandées :
+    - standardisation et matrice de Gram calculées une seule fois par matrice, celles des folds de
+      validation croisée s'en déduisent en retirant le bloc de validation;
+    - chemin de régularisation résolu pour toutes les cibles ensemble, avec démarrage à chaud;
+    - OLS robuste (HC1) sur les variables sélectionnées, en algèbre linéaire NumPy.
+    Retourne (polluant, cible) -> dict (alpha, variables sélectionnées, coefficients, table OLS, r2, n).
+    """
+    alphas = np.sort(np.asarray(alphas, dtype=float))[::-1]
+    features = list(features)
+    results = {}
+
+    for pol, fm in store.items():
+        rows = np.logical_and.reduce([fm.complete_rows(features, t) for t in targets])
+        X = fm.view(features, imputed=False)[rows]
+        Y = np.column_stack([fm.target(t)[rows] for t in targets])
+        n = len(X)
+
+        # Standardisation (StandardScaler) et statistiques suffisantes, une fois par matrice
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1.0
+        Z = (X - X.mean(axis=0)) / scale
+        G_full = Z.T @ Z
+        ZY_full = Z.T @ Y
+
+        # Validation croisée (KFold sans mélange, comme LassoCV)
+        mse = np.zeros((len(alphas), len(targets)))
+        for train, val in KFold(n_splits=cv).split(Z):
+            n_train = len(train)
+            z_mean, y_mean = Z[train].mean(axis=0), Y[train].mean(axis=0)
+            G = G_full - Z[val].T @ Z[val] - n_train * np.outer(z_mean, z_mean)
+            Zy = ZY_full - Z[val].T @ Y[val] - n_train * np.outer(z_mean, y_mean)
+            coefs = _lasso_path_gram(G, Zy, n_train, alphas)
+            pred = np.einsum("vp,apt->avt", Z[val] - z_mean, coefs) + y_mean
+            mse += ((pred - Y[val]) ** 2).mean(axis=1) / cv
+
+        # Ajustement sur toutes les données le long du chemin, puis meilleur alpha de chaque cible
+        z_mean, y_mean = Z.mean(axis=0), Y.mean(axis=0)
+        G = G_full - n * np.outer(z_mean, z_mean)
+        Zy = ZY_full - n * np.outer(z_mean, y_mean)
+        path = _lasso_path_gram(G, Zy, n, alphas)
+
+        for t_idx, target in enumerate(targets):
+            best = int(np.argmin(mse[:, t_idx]))
+            coef = path[best, :, t_idx]
+            selected = [f for f, c in zip(features, coef) if c != 0]
+            ols, r2 = _robust_ols(X[:, coef != 0], Y[:, t_idx], selected) if selected else (None, None)
+            results[(pol, target)] = {
+                "alpha": alphas[best],
+                "selected": selected,
+                "lasso_coef": pd.Series(coef, index=features),
+                "ols": ols,
+                "r2": r2,
+                "n_obs": n
+            }
+
+    return results
+
+
+def lasso_results_table(results):
+    """ Tableau long (polluant, cible, variable) des résultats de lasso_select_many """
+    frames = []
+    for (pol, target), res in results.items():
+        if res["ols"] is None:
+            continue
+        table = res["ols"].rename_axis("variable").reset_index()
+        table.insert(0, "target", target)
+        table.insert(0, "pollutant", pol)
+        table["alpha"] = res["alpha"]
+        frames.append(table)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
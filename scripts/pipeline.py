@@ -0,0 +1,371 @@
+"""
+Exécution de bout en bout de la chaîne du notebook, en ligne de commande :
+
+    python -m scripts.pipeline                  # étapes invalidées uniquement
+    python -m scripts.pipeline --dry-run        # liste des étapes à relancer
+    python -m scripts.pipeline cart --force     # une étape (et ses dépendances), relancée de force
+
+Chaque étape déclare ses fichiers sources, les étapes dont elle dépend, ses sorties, ses paramètres
+et les scripts dont elle dépend. Son empreinte combine le contenu des sources, les empreintes des
+étapes amont, les paramètres et le code : seules les étapes dont l'empreinte a changé (ou dont une
+sortie manque) sont relancées, les étapes indépendantes en parallèle.
+Les bibliothèques lourdes ne sont importées que par les étapes exécutées.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from scripts.config import PATH_AIR, PATH_VILLES, PATH_TOURISME, PATH_COMMUNES, EXCLUDED_PREFIXES
+
+STATE_PATH = "data/cache/pipeline/state.json"
+PROCESSED_DIR = "data/processed_data"
+OUTPUT_DIR = "output/pipeline"
+SEED = 2003
+POLLUTANTS = ["NOX as NO2", "O3", "PM10", "PM2.5"]
+# Variables des graphiques comparatifs -> affichage (sans effet hors du notebook)
+VARS_ECO = {
+    "population_2022": True,
+    "mediane_niveau_vie_2021": False,
+    "densite_population_2022": True,
+    "part_commerce_transport_services_2023": True,
+    "part_industrie_2023": False,
+    "nb_hotels_2022": False,
+    "nb_etablissements_2023": False,
+    "taux_activite_2022": False,
+    "part_construction_2023": False,
+    "nb_campings_2022": False
+}
+
+PATHS = {
+    "geodair": f"{PROCESSED_DIR}/geodair_2022_villes_codgeo_final.feather",
+    "villes": f"{PROCESSED_DIR}/data_villes_tourisme.feather",
+    "etude": f"{PROCESSED_DIR}/data_etude_villes_relevees.feather",
+    "groupe": f"{PROCESSED_DIR}/data_groupe_polluant_ville.feather",
+    "par_polluant": f"{PROCESSED_DIR}/BDD_par_polluant",
+    "lasso": f"{OUTPUT_DIR}/lasso_ols.csv",
+    "cart": OUTPUT_DIR + "/cart_{pol}.csv",
+    "cart_table": f"{OUTPUT_DIR}/cart_resultats.csv",
+    "desc": "output/Desc_All_Cities",
+    "comparaison": "output/plots_comparaison"
+}
+
+
+class Stage:
+
+    """ Étape du pipeline : func(**params) lit ses entrées et écrit ses sorties (chemins de PATHS) """
+
+    def __init__(self, name, func, sources=(), deps=(), outputs=(), params=None, code=()):
+        self.name = name
+        self.func = func
+        self.sources = list(sources)
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.code = list(code)
+
+
+# ---------------------------------------------------------------------------------------------------------
+# Étapes
+
+def _slug(pol):
+    return "".join(c if c.isalnum() else "_" for c in pol).strip("_")
+
+
+def _read(name):
+    from scripts import ingest
+    return ingest.read_table(PATHS[name])
+
+
+def _write(df, name):
+    from scripts import ingest
+    ingest.write_table(df, PATHS[name])
+
+
+def _store():
+    from scripts import feature_store
+    return feature_store.build_feature_store(_read("groupe"))
+
+
+def stage_geodair(fallback_api):
+    """
+    Mesures Geodair géocodées (CODGEO, ville, coordonnées de la commune), hors Corse et outre-mer.
+    Géocodage par l'API (commune contenant la station); en mode hors-ligne (--offline), géocodage approché
+    par le centre de commune le plus proche du référentiel PATH_COMMUNES (data.gouv.fr), alors indispensable.
+    Sans ce référentiel, les coordonnées des communes ne sont pas ajoutées.
+    """
+    import pandas as pd
+    from scripts import add_city_columns_insee
+
+    has_communes = os.path.exists(PATH_COMMUNES)
+    if not has_communes and not fallback_api:
+        raise FileNotFoundError(f"Le géocodage hors-ligne (--offline) nécessite le référentiel des communes "
+                                f"{PATH_COMMUNES} (data.gouv.fr), introuvable")
+
+    geodair = pd.read_csv(PATH_AIR, sep=";")
+    add_city_columns_insee.add_city_codes(geodair, fallback_api=fallback_api, offline=not fallback_api)
+    geodair = geodair.dropna(subset=["CODGEO"])
+
+    if has_communes:
+        communes = add_city_columns_insee.load_communes_reference(PATH_COMMUNES)
+        geodair = geodair.merge(communes[["CODGEO", "Latitude_commune", "Longitude_commune"]], on="CODGEO", how="left")
+    else:
+        print(f"Référentiel {PATH_COMMUNES} absent : coordonnées des communes non ajoutées")
+    geodair = geodair[~geodair["CODGEO"].str.startswith(EXCLUDED_PREFIXES)]
+    _write(geodair, "geodair")
+
+
+def stage_villes():
+    from scripts import preprocessing
+    df_raw_villes = preprocessing.load_and_merge_cities(PATH_VILLES, PATH_TOURISME)
+    _write(preprocessing.process_city_data(df_raw_villes), "villes")
+
+
+def stage_etude():
+    from scripts import preprocessing
+    _write(preprocessing.prepare_geodair_data(_read("geodair"), _read("villes")), "etude")
+
+
+def stage_groupe():
+    """ Agrégation par polluant et par ville, et un CSV par polluant """
+    from scripts import preprocessing
+    df_groupe = preprocessing.aggregate_by_pollutant(_read("etude"))
+    _write(df_groupe, "groupe")
+
+    os.makedirs(PATHS["par_polluant"], exist_ok=True)
+    for pol, df_pol in df_groupe.groupby("polluant"):
+        df_pol.to_csv(f"{PATHS['par_polluant']}/dataset_{pol}_final.csv", index=False, sep=";")
+
+
+def stage_lasso(targets):
+    from scripts import lasso
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    results = lasso.lasso_select_many(_store(), targets=tuple(targets))
+    lasso.lasso_results_table(results).to_csv(PATHS["lasso"], index=False, sep=";")
+
+
+def stage_cart(pol, seed):
+    """
+    Arbres CART d'un polluant (benchmark naïf et clustering), cf. training.train_all.
+    La grille cart.PARAM_GRID fait partie de l'empreinte du code de scripts/cart.py.
+    """
+    from scripts import training
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    table = training.train_all(_store(), seed, pollutants=[pol], n_jobs=1)
+    table.to_csv(PATHS["cart"].format(pol=_slug(pol)), index=False, sep=";")
+
+
+def stage_cart_table(pollutants):
+    import pandas as pd
+    frames = [pd.read_csv(PATHS["cart"].format(pol=_slug(pol)), sep=";") for pol in pollutants]
+    table = pd.concat(frames, ignore_index=True).sort_values(by="R2 Score", ascending=False)
+    table.to_csv(PATHS["cart_table"], index=False, sep=";")
+    print(table.to_string(index=False))
+
+
+def stage_plots_villes():
+    """ Distributions et corrélations des variables de toutes les villes """
+    from scripts import descriptive_visualization as viz
+    df_villes = _read("villes")
+    viz.plot_distributions(df_villes, [c for c in VARS_ECO if c in df_villes.columns], output_dir=PATHS["desc"])
+    viz.plot_correlation_heatmap(df_villes, output_dir=PATHS["desc"])
+
+
+def stage_plots_pol(pol):
+    """ Distributions comparées (France / échantillon) et corrélations pour un polluant """
+    from scripts import descriptive_visualization as viz
+    df_groupe = _read("groupe")
+    df_pol = df_groupe[df_groupe["polluant"] == pol]
+    viz.plot_comparative_distributions(df_pol, _read("villes"), pol, VARS_ECO, output_dir=PATHS["comparaison"])
+    viz.plot_correlation_heatmap(df_pol, output_dir=PATHS["desc"], pol=pol)
+
+
+def stage_plots_combined(pollutants):
+    from scripts import descriptive_visualization as viz
+    df_groupe = _read("groupe")
+    samples = {pol: df_groupe[df_groupe["polluant"] == pol] for pol in pollutants}
+    viz.plot_combined_distributions_per_var(samples, _read("villes"), VARS_ECO, output_dir=PATHS["comparaison"])
+
+
+def build_stages(seed=SEED, pollutants=POLLUTANTS, fallback_api=True):
+    """ Graphe des étapes, dans un ordre compatible avec leurs dépendances """
+    prep = ["preprocessing", "commune_codes", "config", "ingest"]
+    stages = [
+        Stage("geodair", stage_geodair, sources=[PATH_AIR, PATH_COMMUNES], outputs=[PATHS["geodair"]],
+              params={"fallback_api": fallback_api},
+              code=["add_city_columns_insee", "geocoding_client", "geocode_cache", "config", "ingest"]),
+        Stage("villes", stage_villes, sources=[PATH_VILLES, PATH_TOURISME], outputs=[PATHS["villes"]], code=prep),
+        Stage("etude", stage_etude, deps=["geodair", "villes"], outputs=[PATHS["etude"]], code=prep),
+        Stage("groupe", stage_groupe, deps=["etude"], outputs=[PATHS["groupe"], PATHS["par_polluant"]], code=prep),
+        Stage("lasso", stage_lasso, deps=["groupe"], outputs=[PATHS["lasso"]], params={"targets": ["valeur_brute"]},
+              code=["lasso", "feature_store", "config"]),
+        Stage("plots_villes", stage_plots_villes, deps=["villes"], outputs=[PATHS["desc"]],
+              code=["descriptive_visualization", "rendering", "correlation"])
+    ]
+    for pol in pollutants:
+        stages += [
+            Stage(f"cart:{pol}", stage_cart, deps=["groupe"], outputs=[PATHS["cart"].format(pol=_slug(pol))],
+                  params={"pol": pol, "seed": seed},
+                  code=["cart", "training", "cluster_encoding", "feature_store", "config"]),
+            Stage(f"plots:{pol}", stage_plots_pol, deps=["groupe", "villes"], params={"pol": pol},
+                  outputs=[f"{PATHS['desc']}/correlogram_{pol}.png"],
+                  code=["descriptive_visualization", "rendering", "correlation"])
+        ]
+    stages += [
+        Stage("cart", stage_cart_table, deps=[f"cart:{pol}" for pol in pollutants], outputs=[PATHS["cart_table"]],
+              params={"pollutants": list(pollutants)}),
+        Stage("plots_combined", stage_plots_combined, deps=["groupe", "villes"], outputs=[PATHS["comparaison"]],
+              params={"pollutants": list(pollutants)}, code=["descriptive_visualization", "rendering"])
+    ]
+    return stages
+
+
+# ---------------------------------------------------------------------------------------------------------
+# Empreintes et exécution
+
+def _file_hash(path, files):
+    """ Empreinte du contenu d'un fichier, recalculée seulement si sa date de modification ou sa taille changent """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    cached = files.get(key)
+    if cached is None or cached[:2] != [stat.st_mtime_ns, stat.st_size]:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        files[key] = cached = [stat.st_mtime_ns, stat.st_size, h.hexdigest()]
+    return cached[2]
+
+
+def fingerprints(stages, files):
+    """ Empreinte de chaque étape : sources, empreintes amont, paramètres, fonction et scripts utilisés """
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for stage in stages:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(stage.func.__name__.encode())
+        for path in stage.sources:
+            h.update(_file_hash(path, files).encode() if os.path.exists(path) else b"absent")
+        for dep in stage.deps:
+            h.update(result[dep].encode())
+        h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+        for module in sorted(set(stage.code + ["pipeline"])):
+            h.update(_file_hash(os.path.join(here, f"{module}.py"), files).encode())
+        result[stage.name] = h.hexdigest()
+    return result
+
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"stages": {}, "files": {}}
+
+
+def _save_state(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def _with_deps(stages, names):
+    """ Étapes demandées et toutes leurs dépendances """
+    by_name = {s.name: s for s in stages}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise ValueError(f"Étapes inconnues : {', '.join(unknown)} (disponibles : {', '.join(by_name)})")
+    keep, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in keep:
+            keep.add(name)
+            todo += by_name[name].deps
+    return [s for s in stages if s.name in keep]
+
+
+def _waves(stages):
+    """ Étapes regroupées par niveau : celles d'un même niveau ne dépendent pas les unes des autres """
+    level = {}
+    for stage in stages:
+        level[stage.name] = 1 + max((level[d] for d in stage.deps), default=-1)
+    return [[s for s in stages if level[s.name] == i] for i in range(max(level.values(), default=-1) + 1)]
+
+
+def _run_stage(name, func, params):
+    """ Exécution d'une étape dans un worker, mesurée si scripts.profiling est activé """
+    from scripts import profiling
+    with profiling.stage(f"pipeline.{name}"):
+        func(**params)
+
+
+def run(targets=None, force=False, dry_run=False, n_jobs=-1, seed=SEED, fallback_api=True, state_path=STATE_PATH):
+    """
+    Exécute les étapes targets (toutes par défaut) et leurs dépendances, en ne relançant que celles dont
+    l'empreinte a changé ou dont une sortie manque (toutes si force). Les étapes indépendantes d'un même
+    niveau sont exécutées en parallèle sur n_jobs processus. Retourne les noms des étapes exécutées.
+    """
+    start = time.perf_counter()
+    stages = build_stages(seed, fallback_api=fallback_api)
+    if targets:
+        stages = _with_deps(stages, targets)
+
+    state = _load_state(state_path)
+    prints = fingerprints(stages, state["files"])
+
+    executed = []
+    for wave in _waves(stages):
+        todo = [
+            s for s in wave
+            if force or state["stages"].get(s.name) != prints[s.name] or not all(os.path.exists(p) for p in s.outputs)
+        ]
+        if not todo:
+            continue
+        print(f"Étapes à exécuter : {', '.join(s.name for s in todo)}")
+        if dry_run:
+            executed += [s.name for s in todo]
+            continue
+
+        from joblib import Parallel, delayed
+        Parallel(n_jobs=min(len(todo), n_jobs) if n_jobs > 0 else n_jobs)(
+            delayed(_run_stage)(s.name, s.func, s.params) for s in todo
+        )
+        for s in todo:
+            state["stages"][s.name] = prints[s.name]
+            executed.append(s.name)
+        _save_state(state, state_path)
+
+    if not dry_run:
+        _save_state(state, state_path)
+    verb = "à exécuter" if dry_run else "exécutée(s)"
+    print(f"{len(executed)} étape(s) {verb} sur {len(stages)} en {time.perf_counter() - start:.2f}s")
+    return executed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scripts.pipeline", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("stages", nargs="*", help="étapes à exécuter (toutes par défaut)")
+    parser.add_argument("--force", action="store_true", help="relance les étapes même si elles sont à jour")
+    parser.add_argument("--dry-run", action="store_true", help="affiche les étapes à relancer sans les exécuter")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="processus pour les étapes indépendantes")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--offline", action="store_true", help="géocodage sans appel à l'API data.gouv.fr")
+    parser.add_argument("--list", action="store_true", help="liste les étapes et leurs dépendances")
+    parser.add_argument("--profile", metavar="LOG", help="journalise la durée des étapes et fonctions (JSON Lines)")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        # Variables d'environnement héritées par les workers (cf. scripts.profiling)
+        os.environ["PROFILE_STAGES"] = "1"
+        os.environ["PROFILE_STAGES_LOG"] = args.profile
+
+    if args.list:
+        for stage in build_stages(args.seed):
+            print(f"{stage.name:<20} <- {', '.join(stage.deps + stage.sources) or '-'}")
+        return
+    run(args.stages or None, force=args.force, dry_run=args.dry_run, n_jobs=args.n_jobs, seed=args.seed,
+        fallback_api=not args.offline)
+
+
+if __name__ == "__main__":
+    main()
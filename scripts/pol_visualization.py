@@ -1,50 +1,151 @@
+import hashlib
+import json
+import os
 import geopandas as gpd
+import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-from cartiflette import carti_download
 
 
+BASEMAP_PATH = "data/cache/basemap/regions_metropole_{crs}.parquet"   # Un cache par projection
+BASEMAP_CRS = 4326
+# Paramètres du téléchargement cartiflette (régions simplifiées, COG 2022)
+CARTIFLETTE_PARAMS = {
+    "values": ["France"],
+    "borders": "REGION",
+    "vectorfile_format": "geojson",
+    "simplification": 50,
+    "filter_by": "FRANCE_ENTIERE",
+    "source": "EXPRESS-COG-CARTO-TERRITOIRE",
+    "year": 2022
+}
+
+EXPORT_DIR = "output/carte_interactive"
+COORD_PRECISION = 4                                  # Décimales des coordonnées exportées (~10 m)
+# Tolérance de simplification (degrés) des polygones selon le niveau de zoom à partir duquel ils sont affichés
+ZOOM_TOLERANCES = {0: 0.02, 8: 0.004, 11: 0.0008}
+
+# Fonds de carte déjà chargés, indexés par (source, projection)
+_BASEMAPS = {}
+# Couches de points déjà agrégées, indexées par (version des données fournie par l'appelant, seuils, projection)
+_LAYERS = {}
+
 polluants = ["NOX as NO2", "O3", "PM2.5", "PM10"]
 seuil_OMS = {"NOX as NO2": 10, "O3": 60, "PM2.5": 5, "PM10": 15}
 
 
-def visualization(geodair):
+def _prepare_basemap(france, crs):
+    """ Régions de France métropolitaine (INSEE_REG > 10), projetées dans crs """
+    france = france.loc[france["INSEE_REG"].astype(int) > 10, ["INSEE_REG", "geometry"]]
+    return france.to_crs(epsg=crs).reset_index(drop=True)
+
+
+def load_basemap(source=None, crs=BASEMAP_CRS, cache_path=BASEMAP_PATH):
+    """
+    Fond de carte des régions métropolitaines, chargé une seule fois par session et partagé par les cartes :
+    - source : GeoDataFrame déjà chargé, ou fichier local (GeoParquet, GeoJSON, shapefile, ...) à utiliser
+      à la place du téléchargement;
+    - sinon, lecture du cache GeoParquet cache_path (régions déjà filtrées et projetées), créé au premier
+      appel à partir de cartiflette. Une fois le cache écrit, aucun accès réseau n'est nécessaire.
+    """
+    if isinstance(source, gpd.GeoDataFrame):
+        return _prepare_basemap(source, crs)
+
+    cache_path = cache_path.format(crs=crs)
+    key = (source or cache_path, crs)
+    if key in _BASEMAPS:
+        return _BASEMAPS[key]
+
+    if source is not None:
+        france = gpd.read_parquet(source) if source.endswith(".parquet") else gpd.read_file(source)
+        france = _prepare_basemap(france, crs)
+    elif os.path.exists(cache_path):
+        france = gpd.read_parquet(cache_path)
+    else:
+        from cartiflette import carti_download
+        france = _prepare_basemap(carti_download(crs=4326, **CARTIFLETTE_PARAMS), crs)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        france.to_parquet(cache_path)
+
+    _BASEMAPS[key] = france
+    return france
+
+
+def _points(df, crs):
+    """ Villes (longitude / latitude) en GeoDataFrame, dans la projection du fond de carte """
+    gdf = gpd.GeoDataFrame(
+        df,
+        geometry=gpd.points_from_xy(df["Longitude_commune"], df["Latitude_commune"]),
+        crs="EPSG:4326"
+    )
+    return gdf if gdf.crs == crs else gdf.to_crs(crs)
+
+
+def data_version(geodair):
+    """
+    Empreinte du contenu d'un dataframe (sensible à l'ordre des lignes), à calculer une fois après
+    chargement et à passer en version aux fonctions de cartographie
+    """
+    rows = pd.util.hash_pandas_object(geodair, index=False).to_numpy()
+    h = hashlib.blake2b(rows.tobytes(), digest_size=16)
+    h.update(str(list(geodair.columns)).encode())
+    return h.hexdigest()
+
+
+def pollutant_layers(geodair, thresholds=None, keys=(), crs=None, version=None):
+    """
+    Couches de points de toutes les cartes, en un seul groupby sur (Polluant, CODGEO, coordonnées) :
+    moyenne de la valeur brute par ville et par polluant, et une colonne 'dépassement_<nom>' par
+    jeu de seuils de thresholds (nom -> polluant -> seuil, par défaut {"OMS": seuil_OMS}).
+    keys : colonnes de regroupement supplémentaires (année, ...).
+    version : identifiant des données fourni par l'appelant (data_version, chemin et date du fichier, ...);
+    s'il est donné, le résultat est mémorisé et les cartes d'une même version ne parcourent les données
+    qu'une fois. Sans version, rien n'est mémorisé.
+    """
+    thresholds = {"OMS": seuil_OMS} if thresholds is None else thresholds
+    group = ["Polluant", *keys, "CODGEO", "Latitude_commune", "Longitude_commune"]
+    crs = crs or f"EPSG:{BASEMAP_CRS}"
+
+    key = None if version is None else (version, tuple(keys), json.dumps(thresholds, sort_keys=True), str(crs))
+    if key in _LAYERS:
+        return _LAYERS[key]
+
+    data = geodair[group + ["valeur brute"]]
+
+    layers = (
+        data.groupby(group, observed=True, sort=False)
+        .agg({"valeur brute": "mean"})
+        .reset_index()
+    )
+    for name, seuils in thresholds.items():
+        layers[f"dépassement_{name}"] = layers["valeur brute"] >= layers["Polluant"].map(seuils)
+
+    layers = _points(layers, crs)
+    if key is not None:
+        _LAYERS[key] = layers
+    return layers
+
+
+def visualization(geodair, basemap=None, version=None):
 
     """
     Affiche à partir du dataframe geodair, pour chacun des 4 polluants considérés, 
     une carte des villes de France métropolitaine où se situe au moins une station de mesure pour ce polluant,
     colorées en fonction de la quantité de ce polluant présente dans l'air.
+    Fond de carte : cf. load_basemap (basemap : GeoDataFrame ou fichier local).
+    version : identifiant des données, pour partager les couches entre cartes (cf. pollutant_layers).
     """
 
-    france = carti_download(
-        values=["France"],
-        crs=4326,
-        borders="REGION",
-        vectorfile_format="geojson",
-        simplification=50,
-        filter_by="FRANCE_ENTIERE",
-        source="EXPRESS-COG-CARTO-TERRITOIRE",
-        year=2022
-    )
-    france = france.loc[france['INSEE_REG'] > 10]
+    france = load_basemap(basemap)
 
     fig, axes = plt.subplots(2, 2, figsize=(16, 16))
     axes = axes.flatten()
 
-    for i, polluant in enumerate(polluants):
+    layers = pollutant_layers(geodair, crs=france.crs, version=version)
 
-        geodair_polluant = (
-            geodair.loc[geodair["Polluant"] == polluant, :]
-            .groupby(["CODGEO", "Latitude_commune", "Longitude_commune"])
-            .agg({"valeur brute": "mean"})
-            .reset_index()
-        )
+    for i, polluant in enumerate(polluants):
 
-        geodair_gdf = gpd.GeoDataFrame(
-            geodair_polluant,
-            geometry=gpd.points_from_xy(geodair_polluant["Longitude_commune"], geodair_polluant["Latitude_commune"]),
-            crs="EPSG:4326"
-        )
+        geodair_gdf = layers.loc[layers["Polluant"] == polluant]
 
         france.plot(ax=axes[i], edgecolor="black", facecolor="none")
 
@@ -65,25 +166,17 @@ def visualization(geodair):
 
 
 
-def visualization_OMS(geodair):
+def visualization_OMS(geodair, basemap=None, version=None):
 
     """
     Affiche à partir du dataframe geodair, pour chacun des 4 polluants considérés, 
     une carte des villes de France métropolitaine où se situe au moins une station de mesure pour ce polluant,
     colorées en fonction du dépassement où non du seuil recommandé par l'OMS.
+    Fond de carte : cf. load_basemap (basemap : GeoDataFrame ou fichier local).
+    version : identifiant des données, pour partager les couches entre cartes (cf. pollutant_layers).
     """
 
-    france = carti_download(
-        values=["France"],
-        crs=4326,
-        borders="REGION",
-        vectorfile_format="geojson",
-        simplification=50,
-        filter_by="FRANCE_ENTIERE",
-        source="EXPRESS-COG-CARTO-TERRITOIRE",
-        year=2022
-    )
-    france = france.loc[france['INSEE_REG'] > 10]
+    france = load_basemap(basemap)
 
     fig, axes = plt.subplots(2, 2, figsize=(16, 16))
     axes = axes.flatten()
@@ -91,28 +184,17 @@ def visualization_OMS(geodair):
     cmap = mcolors.ListedColormap(['green', 'red'])
     norm = mcolors.BoundaryNorm([0, 0.5, 1], 2)
 
-    for i, polluant in enumerate(polluants):
+    layers = pollutant_layers(geodair, crs=france.crs, version=version)
 
-        geodair_polluant = (
-            geodair.loc[geodair["Polluant"] == polluant, :]
-            .groupby(["CODGEO", "Latitude_commune", "Longitude_commune"])
-            .agg({"valeur brute": "mean"})
-            .reset_index()
-        )
+    for i, polluant in enumerate(polluants):
 
-        geodair_polluant["dépassement"] = geodair_polluant["valeur brute"] >= seuil_OMS[polluant]
-
-        geodair_gdf = gpd.GeoDataFrame(
-            geodair_polluant,
-            geometry=gpd.points_from_xy(geodair_polluant["Longitude_commune"], geodair_polluant["Latitude_commune"]),
-            crs="EPSG:4326"
-        )
+        geodair_gdf = layers.loc[layers["Polluant"] == polluant]
 
         france.plot(ax=axes[i], edgecolor="black", facecolor="none")
 
         geodair_gdf.plot(
             ax=axes[i],
-            column="dépassement",
+            column="dépassement_OMS",
             cmap=cmap,
             norm=norm,
             markersize=20,
@@ -129,3 +211,165 @@ def visualization_OMS(geodair):
 
     plt.tight_layout()
     plt.show()
+
+
+def _slug(name):
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_")
+
+
+def _write_geojson(gdf, path, precision=COORD_PRECISION):
+    """ GeoJSON compact : coordonnées arrondies à precision décimales, sans identifiant de ligne """
+    gdf = gdf.set_geometry(gdf.geometry.set_precision(10 ** -precision))
+    gdf = gdf.loc[~gdf.geometry.is_empty]
+    with open(path, "w") as f:
+        f.write(gdf.to_json(drop_id=True, separators=(",", ":")))
+    return os.path.basename(path)
+
+
+def _range(values):
+    """ [min, max] des valeurs renseignées, [None, None] si aucune (NaN n'est pas du JSON valide) """
+    values = values.dropna()
+    return [float(values.min()), float(values.max())] if len(values) else [None, None]
+
+
+def export_interactive(geodair, output_dir=EXPORT_DIR, communes=None, thresholds=None,
+                       precision=COORD_PRECISION, zoom_tolerances=ZOOM_TOLERANCES, version=None):
+    """
+    Export des cartes pour un affichage interactif dans le navigateur (Leaflet), au lieu de la figure matplotlib :
+    - une couche de points par polluant (moyenne par ville et dépassements des seuils, cf. pollutant_layers);
+    - si communes est fourni (GeoDataFrame de polygones en colonne geometry, avec code_geo et une colonne
+      par polluant, par exemple les prédictions de scripts.prediction), une surface par niveau de zoom de
+      zoom_tolerances, simplifiée une seule fois à l'export : le navigateur charge la version adaptée au zoom.
+    Les coordonnées sont quantifiées à precision décimales. Écrit les GeoJSON, un manifeste et index.html
+    (seul le manifeste y est intégré). Les fichiers étant chargés à la demande par fetch(), bloqué en
+    file:// par les navigateurs, le dossier doit être servi en HTTP : python -m http.server -d output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    layers = pollutant_layers(geodair, thresholds, crs=f"EPSG:{BASEMAP_CRS}", version=version)
+    flags = [c for c in layers.columns if c.startswith("dépassement_")]
+
+    manifest = {"points": [], "surfaces": [], "precision": precision}
+    for polluant, layer in layers.groupby("Polluant", observed=True, sort=False):
+        points = layer[["CODGEO", "valeur brute", *flags, "geometry"]].rename(columns={"valeur brute": "valeur"})
+        points["valeur"] = points["valeur"].round(2)
+        vmin, vmax = _range(points["valeur"])
+        manifest["points"].append({
+            "name": polluant,
+            "file": _write_geojson(points, os.path.join(output_dir, f"points_{_slug(polluant)}.geojson"), precision),
+            "min": vmin, "max": vmax,
+            "flags": flags
+        })
+
+    if communes is not None:
+        communes = communes.to_crs(epsg=BASEMAP_CRS)
+        pollutants = [c for c in communes.columns if c in set(layers["Polluant"])]
+        surface = communes[["code_geo", *pollutants, "geometry"]].copy()
+        surface[pollutants] = surface[pollutants].astype("float64").round(2)
+        for zoom, tolerance in sorted(zoom_tolerances.items()):
+            simplified = surface.set_geometry(surface.geometry.simplify(tolerance, preserve_topology=True))
+            manifest["surfaces"].append({
+                "min_zoom": zoom,
+                "file": _write_geojson(simplified, os.path.join(output_dir, f"communes_z{zoom}.geojson"), precision)
+            })
+        manifest["surface_ranges"] = {pol: _range(surface[pol]) for pol in pollutants}
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(output_dir, "index.html"), "w") as f:
+        f.write(VIEWER_HTML.replace("__MANIFEST__", json.dumps(manifest, ensure_ascii=False)))
+
+    print(f"Carte interactive exportée dans : {output_dir} "
+          f"(à servir en HTTP : python -m http.server -d {output_dir})")
+    return manifest
+
+
+# Visionneuse statique : Leaflet, couleurs coolwarm interpolées côté client. Les couches sont chargées
+# à la demande (fetch) : la page doit être servie en HTTP, fetch() étant bloqué en file:// par Chromium
+VIEWER_HTML = """<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Pollution de l'air - communes de France métropolitaine</title>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map { height: 100%; margin: 0; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+const manifest = __MANIFEST__;
+const files = {};
+function load(file) {
+  return files[file] = files[file] || fetch(file).then(r => r.json());
+}
+if (location.protocol === "file:") {
+  alert("Les couches sont chargées par fetch() : servir ce dossier en HTTP (python -m http.server)");
+}
+const map = L.map("map", {preferCanvas: true}).setView([46.6, 2.4], 6);
+L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png",
+            {attribution: "&copy; OpenStreetMap", maxZoom: 14}).addTo(map);
+
+// Palette coolwarm (bleu -> blanc -> rouge)
+function color(value, min, max) {
+  if (value == null || min == null) return "#999";
+  const t = Math.max(0, Math.min(1, (value - min) / ((max - min) || 1)));
+  const lerp = (a, b, u) => Math.round(a + (b - a) * u);
+  const [c0, c1, u] = t < 0.5 ? [[59, 76, 192], [221, 221, 221], 2 * t] : [[221, 221, 221], [180, 4, 38], 2 * t - 1];
+  return `rgb(${lerp(c0[0], c1[0], u)},${lerp(c0[1], c1[1], u)},${lerp(c0[2], c1[2], u)})`;
+}
+
+const overlays = {};
+const control = L.control.layers(null, overlays, {collapsed: false}).addTo(map);
+
+// Mesures d'un polluant : fichier chargé au premier affichage de la couche
+manifest.points.forEach(layer => {
+  const group = L.geoJSON(null, {
+    pointToLayer: (f, latlng) => L.circleMarker(latlng, {
+      radius: 5, weight: 1, color: "#333", fillOpacity: 0.9,
+      fillColor: color(f.properties.valeur, layer.min, layer.max)
+    }),
+    onEachFeature: (f, l) => l.bindPopup(
+      `${f.properties.CODGEO} : ${f.properties.valeur}` +
+      layer.flags.map(k => `<br>${k} : ${f.properties[k] ? "oui" : "non"}`).join(""))
+  });
+  group.once("add", () => load(layer.file).then(data => group.addData(data)));
+  control.addOverlay(group, `Mesures ${layer.name}`);
+});
+
+// Surfaces communales : fichier simplifié correspondant au zoom courant, rechargé au changement de niveau
+if (manifest.surfaces.length) {
+  const pollutants = Object.keys(manifest.surface_ranges);
+  let current = pollutants[0], file = null, surface = null;
+  function style(f) {
+    const [min, max] = manifest.surface_ranges[current];
+    const v = f.properties[current];
+    return {weight: 0, fillOpacity: v == null ? 0 : 0.6, fillColor: color(v, min, max)};
+  }
+  function refresh() {
+    const level = manifest.surfaces.filter(s => s.min_zoom <= map.getZoom()).pop() || manifest.surfaces[0];
+    if (level.file === file) { surface && surface.setStyle(style); return; }
+    file = level.file;
+    const requested = file;
+    load(file).then(data => {
+      if (requested !== file) return;   // Niveau de zoom changé entre-temps
+      if (surface) map.removeLayer(surface);
+      surface = L.geoJSON(data, {style: style}).addTo(map);
+      surface.bringToBack();
+    });
+  }
+  const select = L.control({position: "topleft"});
+  select.onAdd = () => {
+    const el = L.DomUtil.create("select");
+    pollutants.forEach(p => el.add(new Option(`Prédiction ${p}`, p)));
+    el.onchange = () => { current = el.value; file = null; refresh(); };
+    L.DomEvent.disableClickPropagation(el);
+    return el;
+  };
+  select.addTo(map);
+  map.on("zoomend", refresh);
+  refresh();
+}
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,152 @@
+import datetime
+import glob
+import json
+import os
+import re
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from scripts import cart, ingest, preprocessing
+from scripts.cluster_encoding import ClusterTargetEncoder
+from scripts.config import FEATURES_CART
+
+MODEL_DIR = "data/models"
+MODEL_FORMAT_VERSION = 1
+PATH_PREDICTIONS = "data/processed_data/predictions_communes.feather"
+CHUNKSIZE = 100_000
+
+
+class OLSModel:
+
+    """ Modèle linéaire issu de l'OLS post-LASSO (lasso.lasso_select_many) : constante + coefficients """
+
+    def __init__(self, ols_table):
+        self.intercept = float(ols_table.loc["const", "coef"])
+        self.features = [f for f in ols_table.index if f != "const"]
+        self.coef = ols_table.loc[self.features, "coef"].to_numpy(dtype=np.float64)
+
+    def predict(self, X):
+        return X[self.features].to_numpy(dtype=np.float64) @ self.coef + self.intercept
+
+
+def _model_name(variant, pol):
+    return f"{variant}_" + re.sub(r"[^0-9A-Za-z]+", "_", pol).strip("_")
+
+
+def save_model(model, pol, variant, features, target, medians, log_target=False, model_dir=MODEL_DIR, **metadata):
+    """
+    Enregistre un modèle ajusté (joblib) et ses métadonnées versionnées (JSON) : polluant, variables
+    et médianes d'imputation, cible, passage en log, versions du format et de scikit-learn
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    name = _model_name(variant, pol)
+    joblib.dump(model, os.path.join(model_dir, f"{name}.joblib"))
+
+    meta = {
+        "format_version": MODEL_FORMAT_VERSION,
+        "sklearn_version": sklearn.__version__,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "pollutant": pol,
+        "variant": variant,
+        "features": list(features),
+        "medians": [float(m) for m in medians],
+        "target": target,
+        "log_target": log_target,
+        **metadata
+    }
+    with open(os.path.join(model_dir, f"{name}.json"), "w") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return name
+
+
+def load_models(variant="naive", model_dir=MODEL_DIR):
+    """ Modèles enregistrés pour une variante : polluant -> (modèle, métadonnées) """
+    models = {}
+    for path in sorted(glob.glob(os.path.join(model_dir, f"{variant}_*.json"))):
+        with open(path) as f:
+            meta = json.load(f)
+        if meta["format_version"] != MODEL_FORMAT_VERSION:
+            raise ValueError(f"{path} : format {meta['format_version']}, attendu {MODEL_FORMAT_VERSION}")
+        if meta["variant"] != variant:
+            continue
+        models[meta["pollutant"]] = (joblib.load(path[:-len(".json")] + ".joblib"), meta)
+    if not models:
+        raise FileNotFoundError(f"Aucun modèle '{variant}' dans {model_dir}")
+    return models
+
+
+def fit_and_save_models(store, seed, variant="naive", target="valeur", reference=None, model_dir=MODEL_DIR):
+    """
+    Ajuste sur toutes les villes mesurées le modèle CART de chaque polluant du feature store, puis l'enregistre :
+    - "naive" : arbre sur les variables brutes;
+    - "clustered" : Pipeline ClusterTargetEncoder (clusters sur reference, par exemple toutes les communes)
+      + arbre, sur la cible en log.
+    """
+    for pol, fm in store.items():
+        rows = ~np.isnan(fm.target(target))
+        X = fm.frame(FEATURES_CART)[rows]
+        y = fm.target(target)[rows]
+        log_target = variant == "clustered"
+        if log_target:
+            y = np.log1p(y)
+            encoder = ClusterTargetEncoder(random_state=seed, reference=reference)
+            model = cart.perform_cart_gridsearch(seed, X, X, y, y, preprocessor=encoder)[0]
+        else:
+            model = cart.perform_cart_gridsearch(seed, X, X, y, y, search="pruning")[0]
+        medians = [fm.medians[fm.features.index(f)] for f in FEATURES_CART]
+        save_model(model, pol, variant, FEATURES_CART, target, medians,
+                   log_target=log_target, model_dir=model_dir, n_train=int(rows.sum()))
+
+
+def save_ols_models(results, store, model_dir=MODEL_DIR):
+    """ Enregistre les OLS post-LASSO de lasso.lasso_select_many (variante "ols") """
+    for (pol, target), res in results.items():
+        if res["ols"] is None:
+            continue
+        fm = store[pol]
+        medians = [fm.medians[fm.features.index(f)] for f in res["selected"]]
+        save_model(OLSModel(res["ols"]), pol, "ols", res["selected"], target, medians,
+                   model_dir=model_dir, alpha=float(res["alpha"]), n_train=res["n_obs"])
+
+
+def predict_communes(df_villes_clean, variant="naive", model_dir=MODEL_DIR, chunksize=CHUNKSIZE,
+                     out_path=PATH_PREDICTIONS):
+    """
+    Prédit la pollution de toutes les communes de df_villes_clean pour chaque polluant modélisé, par
+    morceaux de chunksize communes (valeurs manquantes imputées par les médianes d'apprentissage).
+    Écrit la matrice commune x polluant (float32) au format Feather et affiche le débit en lignes/s.
+    """
+    models = load_models(variant, model_dir)
+    start = time.perf_counter()
+
+    n = len(df_villes_clean)
+    preds = {pol: np.empty(n, dtype=np.float32) for pol in models}
+    for lo in range(0, n, chunksize):
+        chunk = df_villes_clean.iloc[lo:lo + chunksize]
+        for pol, (model, meta) in models.items():
+            X = chunk[meta["features"]].astype(np.float64)
+            X = X.fillna(dict(zip(meta["features"], meta["medians"])))
+            y = model.predict(X)
+            preds[pol][lo:lo + chunksize] = np.expm1(y) if meta["log_target"] else y
+
+    out = pd.DataFrame({"code_geo": df_villes_clean["code_geo"].astype(str).to_numpy()})
+    for pol, values in preds.items():
+        out[pol] = values
+    elapsed = time.perf_counter() - start
+
+    if out_path is not None:
+        ingest.write_table(out, out_path)
+    print(f"{n} communes x {len(models)} polluants prédits en {elapsed:.2f}s "
+          f"({n * len(models) / elapsed:,.0f} lignes/s)")
+    return out
+
+
+def score_france(path_villes, path_tourisme, variant="naive", model_dir=MODEL_DIR, out_path=PATH_PREDICTIONS):
+    """
+    Chaîne complète à relancer à chaque mise à jour des données INSEE : villes nettoyées
+    (cache invalidé par le contenu des fichiers), puis prédiction de toutes les communes
+    """
+    df_villes_clean = preprocessing.load_clean_cities(path_villes, path_tourisme)
+    return predict_communes(df_villes_clean, variant, model_dir, out_path=out_path)
@@ -1,12 +1,19 @@
 import pandas as pd
 import numpy as np
-from scripts.config import RENAME_VILLES_FULL, UNAVAILABLE_VALUES, RENAME_GEODAIR
+from scripts.config import (
+    RENAME_VILLES_FULL, UNAVAILABLE_VALUES, RENAME_GEODAIR, SCHEMA_VILLES, EXCLUDED_PREFIXES, STRATA
+)
+from scripts import ingest, commune_codes, profiling
 
 
-def load_and_merge_cities(path_villes, path_tourisme):
-    """Import des données et jointure des données touristiques sur les villes"""
-    data_villes = pd.read_csv(path_villes, sep=";")
-    data_tourisme = pd.read_csv(path_tourisme, sep=";")
+def load_and_merge_cities(path_villes, path_tourisme, use_cache=False):
+    """
+    Import des données et jointure des données touristiques sur les villes
+    (use_cache=True : lecture via le cache columnaire de scripts.ingest)
+    """
+    read = ingest.read_csv_cached if use_cache else pd.read_csv
+    data_villes = read(path_villes, sep=";")
+    data_tourisme = read(path_tourisme, sep=";")
 
     data_villes.rename(columns={'Code': "CODGEO"}, inplace=True)
     df_merged = data_villes.merge(data_tourisme, on="CODGEO", how="left")
@@ -14,46 +21,74 @@ def load_and_merge_cities(path_villes, path_tourisme):
     return df_merged
 
 
+@profiling.timed()
+def load_city_data(path_villes, path_tourisme):
+    """
+    Import des villes en une seule passe typée : les codes sont lus comme chaînes et les valeurs
+    'N/A - ...' deviennent NaN dès la lecture, puis process_city_data applique le schéma
+    """
+    data_villes = pd.read_csv(path_villes, sep=";", dtype=str, na_values=UNAVAILABLE_VALUES)
+    data_tourisme = pd.read_csv(path_tourisme, sep=";", dtype={"CODGEO": str})
+
+    data_villes.rename(columns={'Code': "CODGEO"}, inplace=True)
+    df_merged = data_villes.merge(data_tourisme, on="CODGEO", how="left")
+
+    return process_city_data(df_merged)
+
+
+def load_clean_cities(path_villes, path_tourisme, columns=None):
+    """
+    Villes nettoyées (load_city_data), converties une seule fois au format columnaire;
+    seules les colonnes demandées sont relues ensuite
+    """
+    return ingest.cached_frame(
+        "villes_clean", [path_villes, path_tourisme],
+        lambda: load_city_data(path_villes, path_tourisme),
+        params={"schema": SCHEMA_VILLES, "na": UNAVAILABLE_VALUES},
+        columns=columns, code=[commune_codes]
+    )
+
+
+def parse_numeric(s, dtype="float32"):
+    """Conversion d'une colonne en numérique (virgule décimale, valeurs 'N/A - ...' -> NaN)"""
+    if not pd.api.types.is_numeric_dtype(s):
+        s = s.where(~s.isin(UNAVAILABLE_VALUES)).str.replace(',', '.', regex=False)
+        try:
+            return s.astype(dtype)
+        except ValueError:
+            # Valeur non numérique inattendue : conversion lente avec coercition en NaN
+            s = pd.to_numeric(s, errors='coerce')
+    return s.astype(dtype)
+
+
+@profiling.timed()
 def process_city_data(df):
-    """Nettoyage du dataframe des villes"""
+    """Nettoyage du dataframe des villes, colonne par colonne selon SCHEMA_VILLES"""
     # Renommage
     df = df.rename(columns=RENAME_VILLES_FULL)
 
-    # Gestion des valeurs manquantes
-    df = df.replace({',': '.'}, regex=True)
-    df = df.replace(UNAVAILABLE_VALUES, np.nan)
-
-    # Suppressions des villes de Corse et d'outre-mer
-    df["code_geo"] = df["code_geo"].astype(str)
-    df = df[~df["code_geo"].str.startswith(("2A", "2B", "97"))]
+    # Suppressions des villes de Corse et d'outre-mer (avant toute conversion)
+    code_geo = df["code_geo"].astype(str)
+    mask = ~code_geo.str.startswith(EXCLUDED_PREFIXES).to_numpy()
 
-    # Gestion des types
-    df["libelle"] = df["libelle"].astype(str)
-    numeric_cols = df.columns.drop(["code_geo", "libelle"])
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # Gestion des types et des valeurs manquantes, uniquement sur les colonnes numériques
+    cols = {"code_geo": code_geo[mask], "libelle": df.loc[mask, "libelle"].astype(str)}
+    for col in df.columns.drop(["code_geo", "libelle"]):
+        cols[col] = parse_numeric(df.loc[mask, col], SCHEMA_VILLES.get(col, "float32"))
 
-    return df
+    return pd.DataFrame(cols)
 
 
 def harmonize_geodair_codes(df):
     """
     Mapping des arrondissements de Paris, Lyon, Marseille vers la ville mère
+    (table COG_MAPPING, appliquée en une passe sur les codes distincts)
     """
-    # Dictionnaire de redirection PLM (Paris, Lyon, Marseille)
-    # On utilise des regex pour capter tous les codgeo d'arrondissements
-    plm_mapping = {
-        r'^751\d{2}$': '75056',  # Paris : de 75101 à 75120 -> 75056
-        r'^132\d{2}$': '13055',  # Marseille : de 13201 à 13216 -> 13055
-        r'^693\d{2}$': '69123'   # Lyon : de 69381 à 69389 -> 69123
-    }
-
-    for pattern, replacement in plm_mapping.items():
-        df['codgeo'] = df['codgeo'].replace(pattern, replacement, regex=True)
-
+    df['codgeo'] = commune_codes.normalize_codes(df['codgeo'])
     return df
 
 
+@profiling.timed()
 def prepare_geodair_data(df_geodair, df_villes_clean):
     """Fusion des données météo avec le dataset des villes"""
     # Renommage
@@ -68,39 +103,41 @@ def prepare_geodair_data(df_geodair, df_villes_clean):
                 df_geodair[col] = df_geodair[col].str.replace(',', '.')
             df_geodair[col] = pd.to_numeric(df_geodair[col], errors='coerce')
 
-    # Standardisation de la colonne de jointure (pour éviter son dédoublement)
-    df_geodair['codgeo'] = df_geodair['codgeo'].str.replace('.0', '', regex=False)
+    # Standardisation de la colonne de jointure et mapping des CODGEO pour les villes avec arrondissement
+    # (sinon la jointure ne fonctionnera pas, puisque les CODGEO de df_geodair et df_villes sont différents)
+    df_geodair = harmonize_geodair_codes(df_geodair)
 
     # Renommage des colonnes avant la jointure
-    df_villes_prep = df_villes_clean.copy()
-    df_villes_prep = df_villes_prep.rename(columns={'code_geo': 'codgeo', 'libelle': 'nom_commune'})
-    df_villes_prep['codgeo'] = df_villes_prep['codgeo'].str.replace('.0', '', regex=False)
-    # Suppression des observations en Corse et outre-mer
-    df_geodair = df_geodair[~df_geodair["codgeo"].str.startswith(("2A", "2B", "97"))]
+    df_villes_prep = df_villes_clean.rename(columns={'code_geo': 'codgeo', 'libelle': 'nom_commune'})
+    df_villes_prep['codgeo'] = commune_codes.normalize_codes(df_villes_prep['codgeo'], mapping=None)
 
-    # Mapping des CODGEO pour les villes avec arrondissement
-    # (sinon la jointure ne fonctionnera pas, puisque les CODGEO de df_geodair et df_villes sont différents)
-    df_geodair = harmonize_geodair_codes(df_geodair)
+    # Suppression des observations en Corse et outre-mer
+    df_geodair = df_geodair[~commune_codes.is_excluded(df_geodair['codgeo'])]
 
-    # Jointure
-    df_merged = pd.merge(df_geodair, df_villes_prep, on="codgeo", how="left")
+    # Jointure sur des clés catégorielles communes aux deux tables
+    keys_geodair, keys_villes = commune_codes.shared_keys(df_geodair['codgeo'], df_villes_prep['codgeo'])
+    df_merged = pd.merge(df_geodair.assign(codgeo=keys_geodair), df_villes_prep.assign(codgeo=keys_villes),
+                         on="codgeo", how="left")
 
     return df_merged
 
 
+# Caractéristiques des villes, constantes pour un couple (polluant, ville) : première valeur conservée
+COLS_FIRST = [
+    "codgeo", "nom_commune", "population_2022", "mediane_niveau_vie_2021",
+    "densite_population_2022", "part_commerce_transport_services_2023",
+    "part_industrie_2023", "nb_hotels_2022", "nb_etablissements_2023",
+    "taux_activite_2022", "part_construction_2023", "nb_campings_2022"
+]
+
+
+@profiling.timed()
 def aggregate_by_pollutant(df_complete):
     """Aggrégation des mesures de l'air par polluant et par ville"""
     # Définition des règles d'aggrégation
     regles = {"valeur": "mean", "valeur_brute": "mean"}
 
-    cols_first = [
-        "codgeo", "nom_commune", "population_2022", "mediane_niveau_vie_2021",
-        "densite_population_2022", "part_commerce_transport_services_2023",
-        "part_industrie_2023", "nb_hotels_2022", "nb_etablissements_2023",
-        "taux_activite_2022", "part_construction_2023", "nb_campings_2022"
-    ]
-
-    for col in cols_first:
+    for col in COLS_FIRST:
         if col in df_complete.columns:
             regles[col] = "first"
     df_aggrege = df_complete.groupby(["polluant", "ville"], as_index=False).agg(regles)
@@ -108,46 +145,82 @@ def aggregate_by_pollutant(df_complete):
     return df_aggrege
 
 
-def analyze_city_size_distribution(df, pol_name):
+def strata_codes(values, edges):
+    """ Classe [edges[i], edges[i+1]) de chaque valeur (np.searchsorted), -1 si manquante ou hors bornes """
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.searchsorted(edges, values, side="right") - 1
+    codes[np.isnan(values) | (codes >= len(edges) - 1)] = -1
+    return codes
+
+
+@profiling.timed()
+def stratified_stats(df, strata=STRATA, value="valeur", by="polluant", quantiles=(0.25, 0.75)):
     """
-    Calcule la concentration moyenne de chaque polluant dans chaque taille de ville
+    Statistiques de value (effectif, proportion, moyenne, médiane, quantiles) par groupe de by (polluant)
+    et par classe de chaque variable de stratification (variable -> (bornes, libellés), cf. config.STRATA).
+    Les codes de classe sont calculés sans copie du dataframe, puis toutes les variables et tous les
+    polluants sont agrégés en un seul groupby. Retourne un tableau indexé par (polluant, variable, classe),
+    où figurent aussi les classes vides.
     """
-    # Duplication du dataframe pour éviter son altération
-    df_calc = df.copy()
+    missing = [c for c in [*strata, value] if c not in df.columns]
+    if missing:
+        raise ValueError(f"Colonnes manquantes : {', '.join(missing)}")
 
-    # Définition de 4 catégories de villes, selon leur population
-    # Rurale (<2k), Petite (2-10k), Moyenne (10-50k), Grande (>50k)
-    bins = [0, 2000, 10000, 50000, float('inf')]
-    labels = ['Rurale (<2k)', 'Petite (2-10k)', 'Moyenne (10-50k)', 'Grande (>50k)']
-
-    # Vérification qu'une colonne population_2022 existe bien
-    if 'population_2022' not in df_calc.columns:
-        print("Erreur: Colonne 'population_2022' manquante.")
-        return
-
-    # Création de la colonne contenant la catégorie de la ville
-    # right=False pour que la borne à gauche soit incluse: [0, 2000), [2000, 10000), etc.
-    df_calc['taille_ville'] = pd.cut(df_calc['population_2022'], bins=bins, labels=labels, right=False)
-
-    # Calcul des statistiques
-    # observed=False assure que toutes les catégories sont affichées, même si elles ont pour valeur 0
-    stats = df_calc.groupby('taille_ville', observed=False).agg(
-        Nb_Villes=('valeur', 'count'),
-        Moyenne_Mesures=('valeur', 'mean')
+    if by is None:
+        groups, group_codes = pd.Index(["Tous"]), np.zeros(len(df), dtype=np.intp)
+    else:
+        group_codes, groups = pd.factorize(df[by], sort=True)
+    y = df[value].to_numpy(dtype=np.float64)
+
+    # Empilement (variable, groupe, classe, valeur) de toutes les stratifications
+    k = len(strata)
+    var_codes = np.repeat(np.arange(k), len(df))
+    class_codes = np.concatenate([strata_codes(df[var].to_numpy(), edges) for var, (edges, _) in strata.items()])
+    keep = class_codes >= 0
+    keys = [var_codes[keep], np.tile(group_codes, k)[keep], class_codes[keep]]
+
+    grouped = pd.Series(np.tile(y, k)[keep]).groupby(keys)
+    stats = grouped.agg(["count", "mean", "median"])
+    stats = stats.join(grouped.quantile(list(quantiles)).unstack().rename(columns=lambda q: f"q{round(q * 100)}"))
+
+    # Index complet (classes vides comprises) avec les libellés
+    index = pd.MultiIndex.from_tuples(
+        [(i, g, c) for g in range(len(groups)) for i, (_, labels) in enumerate(strata.values())
+         for c in range(len(labels))]
     )
+    stats = stats.reindex(index)
+    stats["count"] = stats["count"].fillna(0).astype(int)
+    totals = np.bincount(group_codes[group_codes >= 0], minlength=len(groups))
+    stats.insert(1, "proportion", (stats["count"] / totals[index.get_level_values(1)] * 100).round(2))
+
+    names = list(strata)
+    stats.index = pd.MultiIndex.from_arrays([
+        groups[index.get_level_values(1)],
+        [names[i] for i in index.get_level_values(0)],
+        [strata[names[i]][1][c] for i, c in zip(index.get_level_values(0), index.get_level_values(2))]
+    ], names=[by or "groupe", "variable", "classe"])
+    return stats
 
-    # Calcul des proportions de chaque ville
-    total_villes = len(df_calc)
-    if total_villes > 0:
-        stats['Proportion (%)'] = (stats['Nb_Villes'] / total_villes * 100).round(2)
-    else:
-        stats['Proportion (%)'] = 0.0
 
-    # Arrondi des moyennes pour un affichage plus propre
-    stats['Moyenne_Mesures'] = stats['Moyenne_Mesures'].round(3)
+def analyze_city_size_distribution(df, pol_name, stats=None):
+    """
+    Calcule la concentration moyenne de chaque polluant dans chaque taille de ville
+    (stats : résultat de stratified_stats déjà calculé pour tous les polluants, sinon calculé sur df)
+    """
+    if stats is None:
+        stats = stratified_stats(df, strata={"population_2022": STRATA["population_2022"]}, by=None)
+        stats = stats.xs("Tous", level=0)
+    else:
+        stats = stats.xs(pol_name, level=0)
 
-    # Nouvel ordre des colonnes
-    stats = stats[['Nb_Villes', 'Proportion (%)', 'Moyenne_Mesures']]
+    # Rurale (<2k), Petite (2-10k), Moyenne (10-50k), Grande (>50k)
+    stats = stats.xs("population_2022", level="variable")
+    stats = pd.DataFrame({
+        "Nb_Villes": stats["count"],
+        "Proportion (%)": stats["proportion"].fillna(0.0),
+        "Moyenne_Mesures": stats["mean"].round(3)
+    })
+    stats.index = pd.CategoricalIndex(stats.index, categories=STRATA["population_2022"][1], name="taille_ville")
 
     # Affichage
     print(f"\n>> Distribution par taille de ville pour : {pol_name}")
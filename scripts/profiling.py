@@ -0,0 +1,81 @@
+"""
+Mesure optionnelle de la durée des étapes (et du pic mémoire Python si demandé), pour journaliser les
+latences d'une exécution de production. Désactivée par défaut : le coût d'une fonction instrumentée
+est alors un simple test. Activation par enable() ou par la variable d'environnement PROFILE_STAGES
+("1" : durées, "memory" : durées et pic mémoire via tracemalloc).
+"""
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_MODE = os.environ.get("PROFILE_STAGES", "")
+ENABLED = _MODE not in ("", "0")
+TRACK_MEMORY = _MODE == "memory"
+LOG_PATH = os.environ.get("PROFILE_STAGES_LOG")   # Fichier JSON Lines facultatif
+
+# Mesures de la session : dictionnaires {stage, seconds, peak_mb}
+RECORDS = []
+
+
+def enable(memory=False, log_path=None):
+    """ Active la mesure des étapes (memory=True : pic mémoire via tracemalloc, plus lent) """
+    global ENABLED, TRACK_MEMORY, LOG_PATH
+    ENABLED, TRACK_MEMORY = True, memory
+    LOG_PATH = log_path or LOG_PATH
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def _record(name, seconds, peak_mb):
+    record = {"stage": name, "seconds": round(seconds, 6), "peak_mb": peak_mb}
+    RECORDS.append(record)
+    logger.info("%s : %.3fs%s", name, seconds, "" if peak_mb is None else f", pic {peak_mb:.1f} Mo")
+    if LOG_PATH:
+        with open(LOG_PATH, "a") as f:
+            f.write(json.dumps({**record, "time": time.time(), "pid": os.getpid()}) + "\n")
+
+
+@contextmanager
+def stage(name):
+    """ Bloc mesuré : with profiling.stage("nom"): ... """
+    if not ENABLED:
+        yield
+        return
+
+    trace = TRACK_MEMORY and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        peak_mb = None
+        if trace:
+            peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+            tracemalloc.stop()
+        _record(name, elapsed, peak_mb)
+
+
+def timed(name=None):
+    """ Décorateur : chaque appel de la fonction est mesuré comme une étape (nom : module.fonction) """
+    def decorator(func):
+        label = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with stage(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
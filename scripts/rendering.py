@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import numpy as np
+from joblib import Parallel, delayed
+
+RENDER_VERSION = 2
+GRIDSIZE = 200                         # Points de la grille des KDE
+KDE_CUT = 3                            # Extension de la grille au-delà des données, en fenêtres
+KEYS_DIR = ".render_cache"             # Empreinte de chaque figure déjà produite (un fichier par figure)
+
+# Histogramme et KDE de référence déjà calculés, indexés par (variable, échelle, empreinte des données)
+_LAYERS = {}
+
+
+def data_hash(*parts):
+    """ Empreinte des données (tableaux) et paramètres (objets JSON) d'une figure """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(RENDER_VERSION).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray) or hasattr(part, "to_numpy"):
+            h.update(np.ascontiguousarray(np.asarray(part, dtype=np.float64)).tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def to_scale(values, log_scale):
+    """ Valeurs finies, en log10 (valeurs strictement positives) si log_scale, comme seaborn """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    return np.log10(values[values > 0]) if log_scale else values
+
+
+def from_scale(values, log_scale):
+    return 10 ** values if log_scale else values
+
+
+def bandwidth(t):
+    """ Fenêtre de Scott (scipy.stats.gaussian_kde, utilisé par seaborn) """
+    return t.std(ddof=1) * len(t) ** (-1 / 5)
+
+
+def kde(t, grid, chunk=4096):
+    """ Densité par noyau gaussien de t évaluée sur grid, par paquets d'observations """
+    if len(t) < 2 or t.std() == 0:
+        return np.zeros_like(grid)
+    h = bandwidth(t)
+    density = np.zeros_like(grid)
+    for lo in range(0, len(t), chunk):
+        u = (grid[:, None] - t[None, lo:lo + chunk]) / h
+        density += np.exp(-0.5 * u ** 2).sum(axis=1)
+    return density / (len(t) * h * np.sqrt(2 * np.pi))
+
+
+def variable_layers(var, reference, log_scale, sample_bins=30):
+    """
+    Classes d'histogramme, grille de KDE, histogramme et KDE de référence (par exemple France entière)
+    d'une variable, calculés une seule fois puis réutilisés pour tous les polluants. Les échantillons
+    utilisent les mêmes grilles (classes regroupées pour environ sample_bins classes).
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    t = to_scale(reference, log_scale)
+    key = (var, log_scale, data_hash(t))
+    if key not in _LAYERS:
+        edges = np.histogram_bin_edges(t, bins="auto")
+        h = bandwidth(t) if len(t) > 1 else 1.0
+        grid = np.linspace(t.min() - KDE_CUT * h, t.max() + KDE_CUT * h, GRIDSIZE)
+        _LAYERS[key] = {
+            "log_scale": log_scale,
+            "edges": edges,
+            # La dernière borne est toujours conservée : sinon les valeurs au-delà de la dernière classe
+            # regroupée disparaîtraient de l'histogramme de l'échantillon
+            "sample_edges": np.unique(np.r_[edges[::max(1, (len(edges) - 1) // sample_bins)], edges[-1]]),
+            "grid": grid,
+            "density": np.histogram(t, edges, density=True)[0],
+            "kde": kde(t, grid),
+            "mean": float(np.mean(reference[np.isfinite(reference)]))
+        }
+    return _LAYERS[key]
+
+
+def _render(spec):
+    """
+    Trace une figure décrite par spec (couches hist / line / vline) sur un canevas Agg propre à la figure :
+    le backend de pyplot n'est pas modifié (rendu possible dans le processus du notebook)
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from scripts.descriptive_visualization import setup_styles
+
+    setup_styles()
+    fig = Figure(figsize=spec["figsize"])
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    for layer in spec["layers"]:
+        if layer["kind"] == "hist":
+            ax.stairs(layer["values"], layer["edges"], **layer["style"])
+        elif layer["kind"] == "line":
+            ax.plot(layer["x"], layer["y"], **layer["style"])
+        else:
+            ax.axvline(layer["x"], **layer["style"])
+
+    if spec.get("log_scale"):
+        ax.set_xscale("log")
+    ax.set_title(spec["title"], fontsize=spec.get("title_size"))
+    if "xlabel" in spec:
+        ax.set_xlabel(spec["xlabel"])
+    if "ylabel" in spec:
+        ax.set_ylabel(spec["ylabel"])
+    if spec.get("legend"):
+        ax.legend(title=spec.get("legend_title"))
+    if spec.get("grid"):
+        ax.grid(True, which="both", linestyle="--", linewidth=0.5, alpha=0.5)
+    if spec.get("tight_layout"):
+        fig.tight_layout()
+
+    fig.savefig(spec["path"], **spec.get("savefig", {}))
+    return spec["path"]
+
+
+def _key_path(fig_path):
+    return os.path.join(os.path.dirname(fig_path), KEYS_DIR, os.path.basename(fig_path) + ".key")
+
+
+def _read_key(fig_path):
+    try:
+        with open(_key_path(fig_path)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_key(fig_path, key):
+    """ Écriture atomique (fichier temporaire puis os.replace) : aucun lecteur ne voit un fichier partiel """
+    path = _key_path(fig_path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(key)
+    os.replace(tmp, path)
+
+
+def render_figures(figures, output_dir, n_jobs=-1):
+    """
+    Produit les figures (dictionnaires path, key = empreinte des données, build = fonction retournant
+    la description de la figure) dont l'empreinte a changé depuis le dernier rendu, en parallèle
+    sur un pool de processus. Retourne les chemins des figures effectivement retracées.
+    L'empreinte de chaque figure est conservée dans son propre fichier (KEYS_DIR) : plusieurs appels
+    concurrents sur un même dossier (étapes parallèles du pipeline) ne s'écrasent pas.
+    """
+    os.makedirs(os.path.join(output_dir, KEYS_DIR), exist_ok=True)
+
+    todo = [
+        fig for fig in figures
+        if _read_key(fig["path"]) != fig["key"] or not os.path.exists(fig["path"])
+    ]
+    if todo:
+        specs = [fig["build"]() for fig in todo]
+        Parallel(n_jobs=min(len(specs), n_jobs) if n_jobs > 0 else n_jobs)(delayed(_render)(s) for s in specs)
+
+        for fig in todo:
+            _write_key(fig["path"], fig["key"])
+
+    return [fig["path"] for fig in todo]
+
+
+def show_figures(paths):
+    """ Affiche des figures déjà enregistrées (dans le notebook) """
+    try:
+        from IPython.display import Image, display
+    except ImportError:
+        return
+    for path in paths:
+        display(Image(filename=path))
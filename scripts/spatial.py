@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+from scripts import commune_codes, ingest, preprocessing
+from scripts.add_city_columns_insee import EARTH_RADIUS_KM, load_communes_reference
+from scripts.config import PATH_AIR, PATH_COMMUNES
+
+RADII_KM = (10, 30)
+# Variables agrégées sur les communes voisines (hors commune elle-même) -> agrégation
+NEIGHBOUR_VARS = {
+    "population_2022": "sum",
+    "nb_etablissements_2023": "sum",
+    "part_industrie_2023": "mean"
+}
+BATCH_SIZE = 5000     # Communes par requête groupée sur l'index spatial
+
+
+def spatial_feature_names(radii=RADII_KM, variables=NEIGHBOUR_VARS):
+    """ Noms des colonnes produites par neighbour_features, dans l'ordre """
+    names = []
+    for r in radii:
+        names.append(f"voisins_{r}km_nb_communes")
+        names += [f"voisins_{r}km_{var}" for var in variables]
+    return names + ["dist_station_km"]
+
+
+SPATIAL_FEATURES = spatial_feature_names()
+
+
+def _to_radians(lats, lons):
+    return np.radians(np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)]))
+
+
+def _radius_aggregates(tree, points, values, radius_km, batch_size=BATCH_SIZE):
+    """
+    Nombre de voisins à moins de radius_km, somme et nombre de valeurs renseignées de chaque colonne
+    de values (n, p) sur ces voisins, la commune elle-même exclue (points = communes de l'index).
+    Requêtes groupées par paquets de batch_size communes, agrégées par np.bincount sur les paires.
+    """
+    n, p = values.shape
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    counts = np.zeros(n)
+    sums = np.zeros((n, p))
+    n_valid = np.zeros((n, p))
+
+    for lo in range(0, n, batch_size):
+        neighbours = tree.query_radius(points[lo:lo + batch_size], r=radius_km / EARTH_RADIUS_KM)
+        sizes = np.fromiter((len(ind) for ind in neighbours), dtype=np.intp, count=len(neighbours))
+        rows = np.repeat(np.arange(lo, lo + len(neighbours)), sizes)
+        cols = np.concatenate(neighbours) if len(neighbours) else np.empty(0, dtype=np.intp)
+        others = rows != cols
+        rows, cols = rows[others], cols[others]
+
+        counts += np.bincount(rows, minlength=n)
+        for j in range(p):
+            sums[:, j] += np.bincount(rows, weights=filled[cols, j], minlength=n)
+            n_valid[:, j] += np.bincount(rows, weights=valid[cols, j], minlength=n)
+    return counts, sums, n_valid
+
+
+def neighbour_features(df_villes_clean, stations, communes=None, radii=RADII_KM, variables=NEIGHBOUR_VARS,
+                       batch_size=BATCH_SIZE):
+    """
+    Variables de voisinage de chaque commune de df_villes_clean (coordonnées du référentiel des communes) :
+    - pour chaque rayon de radii, nombre de communes voisines et agrégats (somme / moyenne) des variables
+      de variables sur ces voisines, distances haversine sur un BallTree, sans boucle sur les paires;
+    - distance (km) à la station de mesure la plus proche (stations : colonnes Latitude / Longitude),
+      presque nulle pour les communes mesurées : à réserver aux prédictions hors échantillon.
+    Les communes sans coordonnées ont des valeurs manquantes. Retourne code_geo + spatial_feature_names().
+    """
+    communes = load_communes_reference() if communes is None else communes
+    ref = communes.assign(code_geo=commune_codes.normalize_codes(communes["CODGEO"]).astype(str))
+    ref = ref.drop_duplicates(subset=["code_geo"])[["code_geo", "Latitude_commune", "Longitude_commune"]]
+
+    codes = commune_codes.normalize_codes(df_villes_clean["code_geo"], mapping=None).astype(str)
+    villes = df_villes_clean[list(variables)].assign(code_geo=codes.to_numpy())
+    villes = villes.merge(ref, on="code_geo", how="left")
+    located = villes["Latitude_commune"].notna().to_numpy()
+
+    points = _to_radians(villes.loc[located, "Latitude_commune"], villes.loc[located, "Longitude_commune"])
+    values = villes.loc[located, list(variables)].to_numpy(dtype=np.float64)
+    tree = BallTree(points, metric="haversine")
+
+    features = {}
+    for r in radii:
+        counts, sums, n_valid = _radius_aggregates(tree, points, values, r, batch_size)
+        features[f"voisins_{r}km_nb_communes"] = counts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for j, (var, how) in enumerate(variables.items()):
+                features[f"voisins_{r}km_{var}"] = sums[:, j] if how == "sum" else sums[:, j] / n_valid[:, j]
+
+    coords = stations[["Latitude", "Longitude"]].dropna().drop_duplicates()
+    station_tree = BallTree(_to_radians(coords["Latitude"], coords["Longitude"]), metric="haversine")
+    features["dist_station_km"] = station_tree.query(points, k=1)[0][:, 0] * EARTH_RADIUS_KM
+
+    out = pd.DataFrame({"code_geo": villes["code_geo"].to_numpy()})
+    for name in spatial_feature_names(radii, variables):
+        column = np.full(len(villes), np.nan, dtype=np.float32)
+        column[located] = features[name]
+        out[name] = column
+    return out
+
+
+def load_spatial_features(path_villes, path_tourisme, path_air=PATH_AIR, path_communes=PATH_COMMUNES,
+                          radii=RADII_KM, variables=NEIGHBOUR_VARS):
+    """
+    Variables de voisinage (neighbour_features) calculées une seule fois par millésime des données :
+    le cache est invalidé si les fichiers INSEE, le référentiel des communes, les mesures (stations)
+    ou les paramètres changent
+    """
+    def build():
+        stations = pd.read_csv(path_air, sep=";", usecols=["Latitude", "Longitude"])
+        df_villes_clean = preprocessing.load_clean_cities(path_villes, path_tourisme)
+        return neighbour_features(df_villes_clean, stations, load_communes_reference(path_communes),
+                                  radii, variables)
+
+    return ingest.cached_frame(
+        "voisinage", [path_villes, path_tourisme, path_air, path_communes], build,
+        params={"radii": list(radii), "variables": variables},
+        code=[preprocessing, commune_codes, load_communes_reference]
+    )
+
+
+def add_spatial_features(df_groupe, spatial):
+    """
+    Ajoute les variables de voisinage à l'agrégat par polluant (jointure sur codgeo). Elles peuvent ensuite
+    être utilisées par les modèles, par exemple feature_store.build_feature_store(df, features=FEATURES_CART
+    + SPATIAL_FEATURES).
+    """
+    keys = commune_codes.normalize_codes(df_groupe["codgeo"], mapping=None).astype(str).to_numpy()
+    spatial = spatial.drop_duplicates(subset=["code_geo"]).set_index("code_geo")
+    return df_groupe.join(spatial.reindex(keys).set_axis(df_groupe.index))
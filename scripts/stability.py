@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error
+from sklearn.tree import DecisionTreeRegressor
+from scripts import cart, lasso
+from scripts.config import FEATURES_CART, FEATURES_LASSO
+
+N_RESAMPLES = 500
+CHUNK_SIZE = 50        # Rééchantillons par tâche envoyée aux workers
+CI = (2.5, 97.5)       # Intervalle de confiance (percentiles bootstrap)
+METRICS = ["r2", "rmse", "mae"]
+
+
+def bootstrap_indices(n, n_resamples=N_RESAMPLES, seed=0):
+    """ Indices des n_resamples rééchantillons bootstrap, générés en un seul tableau (n_resamples, n) """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, n, size=(n_resamples, n), dtype=np.int32)
+
+
+def _counts(idx, n):
+    """ Nombre de tirages de chaque observation dans chaque rééchantillon (b, n) """
+    b = len(idx)
+    flat = (idx + np.arange(b)[:, None] * n).ravel()
+    return np.bincount(flat, minlength=b * n).reshape(b, n)
+
+
+def _oob_metrics(y_true, y_pred):
+    """ r2, rmse, mae sur les observations hors du rééchantillon (NaN s'il y en a moins de 2) """
+    if len(y_true) < 2:
+        return [np.nan] * len(METRICS)
+    return [r2_score(y_true, y_pred), np.sqrt(mean_squared_error(y_true, y_pred)), mean_absolute_error(y_true, y_pred)]
+
+
+def _lasso_chunk(X, y, idx, alpha):
+    """
+    LASSO (variables standardisées dans chaque rééchantillon) au alpha donné : les moyennes, écarts-types
+    et matrices de Gram de tous les rééchantillons du paquet sont calculés ensemble à partir des effectifs
+    """
+    n, p = X.shape
+    counts = _counts(idx, n)
+    mean = counts @ X / n
+    scale = np.sqrt(np.maximum(counts @ X ** 2 / n - mean ** 2, 0))
+    scale[scale == 0] = 1.0
+    y_mean = counts @ y / n
+
+    gram = np.einsum("bn,np,nq->bpq", counts, X, X) - n * mean[:, :, None] * mean[:, None, :]
+    gram /= scale[:, :, None] * scale[:, None, :]
+    xy = (counts @ (X * y[:, None]) - n * mean * y_mean[:, None]) / scale
+
+    selected = np.zeros((len(idx), p), dtype=bool)
+    metrics = np.empty((len(idx), len(METRICS)))
+    for b in range(len(idx)):
+        coef = lasso._lasso_path_gram(gram[b], xy[b][:, None], n, [alpha])[0, :, 0]
+        selected[b] = coef != 0
+        oob = counts[b] == 0
+        pred = ((X[oob] - mean[b]) / scale[b]) @ coef + y_mean[b]
+        metrics[b] = _oob_metrics(y[oob], pred)
+    return selected, metrics, None
+
+
+def _cart_chunk(X, y, idx, params, seed):
+    """ Arbre CART ajusté sur chaque rééchantillon : variables utilisées, variable de la racine, métriques hors-sac """
+    n, p = X.shape
+    counts = _counts(idx, n)
+    selected = np.zeros((len(idx), p), dtype=bool)
+    root = np.full(len(idx), -1)
+    metrics = np.empty((len(idx), len(METRICS)))
+    for b in range(len(idx)):
+        tree = DecisionTreeRegressor(criterion="squared_error", random_state=seed, **params).fit(X[idx[b]], y[idx[b]])
+        used = tree.tree_.feature[tree.tree_.feature >= 0]
+        selected[b, used] = True
+        root[b] = tree.tree_.feature[0]
+        oob = counts[b] == 0
+        metrics[b] = _oob_metrics(y[oob], tree.predict(X[oob]))
+    return selected, metrics, root
+
+
+def _summary(features, selected, metrics, root=None):
+    """ Fréquences de sélection et intervalles de confiance des métriques sur les rééchantillons traités """
+    summary = {
+        "n_resamples": len(selected),
+        "selection_frequency": pd.Series(selected.mean(axis=0), index=features).sort_values(ascending=False),
+        "metrics": pd.DataFrame({
+            "mean": np.nanmean(metrics, axis=0),
+            "ci_low": np.nanpercentile(metrics, CI[0], axis=0),
+            "ci_high": np.nanpercentile(metrics, CI[1], axis=0)
+        }, index=METRICS)
+    }
+    if root is not None:
+        valid = root[root >= 0]
+        summary["root_frequency"] = (pd.Series(np.bincount(valid, minlength=len(features)) / len(root), index=features)
+                                     .sort_values(ascending=False))
+    return summary
+
+
+def iter_stability(X, y, features, model="lasso", alpha=None, params=None, n_resamples=N_RESAMPLES,
+                   seed=0, chunk_size=CHUNK_SIZE, n_jobs=-1):
+    """
+    Stabilité par bootstrap d'une sélection LASSO (model="lasso", au alpha donné) ou d'un arbre CART
+    (model="cart", paramètres params). Les rééchantillons sont répartis par paquets entre processus;
+    un résumé partiel (fréquences de sélection, intervalles de confiance de r2 / rmse / mae hors-sac)
+    est produit après chaque paquet, ce qui permet d'arrêter le calcul dès qu'il est assez précis.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    idx = bootstrap_indices(len(X), n_resamples, seed)
+    chunks = [idx[i:i + chunk_size] for i in range(0, n_resamples, chunk_size)]
+
+    if model == "lasso":
+        task = delayed(_lasso_chunk)
+        tasks = (task(X, y, chunk, alpha) for chunk in chunks)
+    elif model == "cart":
+        task = delayed(_cart_chunk)
+        tasks = (task(X, y, chunk, params, seed) for chunk in chunks)
+    else:
+        raise ValueError(f"Modèle inconnu : {model} (attendu : lasso ou cart)")
+
+    selected, metrics, roots = [], [], []
+    with Parallel(n_jobs=n_jobs, return_as="generator") as parallel:
+        for sel, met, root in parallel(tasks):
+            selected.append(sel)
+            metrics.append(met)
+            if root is not None:
+                roots.append(root)
+            yield _summary(features, np.concatenate(selected), np.concatenate(metrics),
+                           np.concatenate(roots) if roots else None)
+
+
+def stability_selection(store, model="lasso", target=None, n_resamples=N_RESAMPLES, seed=0, n_jobs=-1):
+    """
+    Stabilité de la sélection pour chaque polluant d'un feature store (polluant -> FeatureMatrix) :
+    - "lasso" : cible valeur_brute et alpha choisi par validation croisée (lasso.lasso_select_many);
+    - "cart" : cible valeur et paramètres choisis par perform_cart_gridsearch (mode "pruning") sur l'échantillon.
+    Retourne polluant -> résumé final de iter_stability.
+    """
+    results = {}
+    if model == "lasso":
+        target = target or "valeur_brute"
+        chosen = lasso.lasso_select_many(store, targets=(target,))
+    for pol, fm in store.items():
+        if model == "lasso":
+            rows = fm.complete_rows(FEATURES_LASSO, target)
+            X, y = fm.view(FEATURES_LASSO, imputed=False)[rows], fm.target(target)[rows]
+            options = {"alpha": chosen[(pol, target)]["alpha"]}
+            features = FEATURES_LASSO
+        else:
+            target = target or "valeur"
+            rows = ~np.isnan(fm.target(target))
+            X, y = fm.view(FEATURES_CART)[rows], fm.target(target)[rows]
+            best_model = cart.perform_cart_gridsearch(seed, X, X, y, y, search="pruning", n_jobs=n_jobs)[0]
+            options = {"params": {k: best_model.get_params()[k] for k in cart.PARAM_GRID}}
+            features = FEATURES_CART
+
+        summary = None
+        for summary in iter_stability(X, y, features, model, n_resamples=n_resamples, seed=seed,
+                                      n_jobs=n_jobs, **options):
+            pass
+        results[pol] = summary
+    return results
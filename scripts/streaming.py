@@ -0,0 +1,172 @@
+import os
+import numpy as np
+import pandas as pd
+from scripts import ingest
+from scripts.add_city_columns_insee import build_commune_index, reverse_insee_offline, join_city_codes
+from scripts.preprocessing import prepare_geodair_data, COLS_FIRST
+
+PATH_STATE = "data/cache/stream/aggregates.pkl"
+CHUNKSIZE = 500_000
+KEYS = ["polluant", "ville"]
+VALUE_COLS = ["valeur", "valeur_brute"]
+
+# Classes de l'histogramme utilisé pour les quantiles en flux (concentrations en µg/m3, pas de 0.5)
+QUANTILE_BINS = np.linspace(0, 500, 1001)
+# Attributs de l'état repris par load() (la configuration, quantiles et bins, est vérifiée et non écrasée)
+ACCUMULATORS = ("sums", "first", "groups", "hist", "processed")
+
+
+class StreamingAggregator:
+
+    """
+    Agrégats courants par (polluant, ville), mis à jour morceau par morceau :
+    - somme et nombre de mesures de valeur / valeur_brute (la moyenne s'en déduit);
+    - première valeur non manquante des caractéristiques des villes (COLS_FIRST);
+    - si quantiles est fourni, un histogramme de valeur par groupe (classes QUANTILE_BINS)
+      dont on déduit des quantiles approchés.
+    La mémoire utilisée ne dépend que du nombre de groupes, pas du nombre de lignes lues.
+    Les empreintes des fichiers déjà traités sont conservées pour ne lire que les nouveaux.
+    """
+
+    def __init__(self, quantiles=None, bins=QUANTILE_BINS):
+        self.quantiles = tuple(quantiles) if quantiles else ()
+        self.bins = np.asarray(bins, dtype=float)
+        self.sums = None
+        self.first = None
+        self.groups = pd.MultiIndex.from_tuples([], names=KEYS)
+        self.hist = np.zeros((0, len(self.bins) - 1), dtype=np.int64)
+        self.processed = {}
+
+    def update(self, df):
+        """Intègre un morceau déjà joint aux villes (sortie de prepare_geodair_data)"""
+        df = df.dropna(subset=KEYS)
+        if df.empty:
+            return
+
+        grouped = df.groupby(KEYS, sort=False, observed=True)
+        values = [c for c in VALUE_COLS if c in df.columns]
+        sums = pd.concat([grouped[values].sum().add_suffix("_sum"),
+                          grouped[values].count().add_suffix("_count")], axis=1)
+        self.sums = sums if self.sums is None else self.sums.add(sums, fill_value=0)
+
+        cols_first = [c for c in COLS_FIRST if c in df.columns]
+        first = grouped[cols_first].first()
+        if "codgeo" in first.columns:
+            # Les catégories des codes diffèrent d'un morceau à l'autre
+            first["codgeo"] = first["codgeo"].astype(object)
+        self.first = first if self.first is None else self.first.combine_first(first)
+
+        if self.quantiles:
+            self._update_hist(df)
+
+    def _update_hist(self, df):
+        df = df.dropna(subset=["valeur"])
+        keys = pd.MultiIndex.from_frame(df[KEYS].astype(object))
+
+        new_groups = keys.unique().difference(self.groups)
+        if len(new_groups):
+            self.groups = self.groups.append(new_groups)
+            self.hist = np.vstack([self.hist, np.zeros((len(new_groups), self.hist.shape[1]), dtype=np.int64)])
+
+        n_bins = self.hist.shape[1]
+        pos = self.groups.get_indexer(keys)
+        b = np.clip(np.searchsorted(self.bins, df["valeur"].to_numpy(dtype=float), side="right") - 1, 0, n_bins - 1)
+        self.hist += np.bincount(pos * n_bins + b, minlength=self.hist.size).reshape(self.hist.shape)
+
+    def _hist_quantiles(self):
+        """Quantiles approchés par interpolation linéaire dans la classe de l'histogramme"""
+        cum = np.cumsum(self.hist, axis=1)
+        total = cum[:, -1]
+        out = {}
+        for q in self.quantiles:
+            target = q * total
+            k = np.minimum((cum < target[:, None]).sum(axis=1), self.hist.shape[1] - 1)
+            rows = np.arange(len(k))
+            before = np.where(k > 0, cum[rows, np.maximum(k - 1, 0)], 0)
+            count = self.hist[rows, k]
+            frac = np.divide(target - before, count, out=np.zeros(len(k)), where=count > 0)
+            value = self.bins[k] + frac * (self.bins[k + 1] - self.bins[k])
+            out[f"valeur_q{round(q * 100)}"] = np.where(total > 0, value, np.nan)
+        return pd.DataFrame(out, index=self.groups)
+
+    def result(self):
+        """Dataframe agrégé, au format de preprocessing.aggregate_by_pollutant"""
+        if self.sums is None:
+            return pd.DataFrame(columns=KEYS + VALUE_COLS)
+
+        df = pd.DataFrame(index=self.sums.index)
+        for col in VALUE_COLS:
+            if f"{col}_sum" in self.sums.columns:
+                df[col] = self.sums[f"{col}_sum"] / self.sums[f"{col}_count"].replace(0, np.nan)
+        df = df.join(self.first.drop(columns="nom_commune", errors="ignore"))
+        if self.quantiles:
+            df = df.join(self._hist_quantiles())
+
+        return df.sort_index().reset_index()
+
+    def save(self, path=PATH_STATE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        pd.to_pickle(self.__dict__, tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=PATH_STATE, quantiles=None):
+        """
+        Recharge les agrégats enregistrés par save(), ou un agrégateur vide s'il n'existe pas.
+        Les histogrammes n'étant tenus que pour la configuration de quantiles de l'état enregistré,
+        une configuration différente (quantiles ou classes) lève une ValueError : supprimer path
+        pour repartir de zéro.
+        """
+        agg = cls(quantiles=quantiles)
+        if os.path.exists(path):
+            state = pd.read_pickle(path)
+            saved_bins = np.asarray(state["bins"], dtype=float)
+            if state["quantiles"] != agg.quantiles or not np.array_equal(saved_bins, agg.bins):
+                raise ValueError(f"L'état {path} a été calculé avec quantiles={state['quantiles']} "
+                                 f"({len(saved_bins) - 1} classes), différent de quantiles={agg.quantiles} "
+                                 f"({len(agg.bins) - 1} classes)")
+            for name in ACCUMULATORS:
+                setattr(agg, name, state[name])
+        return agg
+
+
+def iter_geodair_chunks(path, df_villes_clean, chunksize=CHUNKSIZE, communes=None, index=None, sep=";"):
+    """
+    Lecture d'un fichier Geodair par morceaux de chunksize lignes : chaque morceau est géocodé hors-ligne
+    si nécessaire (colonne CODGEO absente et référentiel communes fourni), puis harmonisé et joint
+    aux villes par prepare_geodair_data
+    """
+    for chunk in pd.read_csv(path, sep=sep, chunksize=chunksize, dtype={"CODGEO": str}):
+        if "CODGEO" not in chunk.columns and communes is not None:
+            lookup = chunk[["Latitude", "Longitude"]].drop_duplicates()
+            cities, codes = reverse_insee_offline(lookup["Latitude"], lookup["Longitude"], communes, index)
+            join_city_codes(chunk, lookup.assign(Ville=cities, CODGEO=codes))
+        yield prepare_geodair_data(chunk, df_villes_clean)
+
+
+def stream_aggregate(paths, df_villes_clean, state_path=PATH_STATE, chunksize=CHUNKSIZE,
+                     quantiles=None, communes=None):
+    """
+    Agrégation par (polluant, ville) de fichiers Geodair de taille quelconque (mesures horaires ou
+    journalières, plusieurs années) en mémoire bornée. Si state_path est fourni, l'état est repris
+    de l'exécution précédente et seuls les fichiers non encore traités sont lus; il est enregistré
+    après chaque fichier.
+    """
+    agg = StreamingAggregator.load(state_path, quantiles) if state_path else StreamingAggregator(quantiles)
+    index = build_commune_index(communes) if communes is not None else None
+
+    for path in paths:
+        key = ingest.file_hash(path)
+        if key in agg.processed.values():
+            continue
+        if os.path.abspath(path) in agg.processed:
+            # Fichier déjà intégré puis modifié : ses anciennes mesures ne peuvent pas être retirées
+            raise ValueError(f"{path} a changé depuis son intégration, supprimer {state_path} pour tout recalculer")
+        for df in iter_geodair_chunks(path, df_villes_clean, chunksize, communes, index):
+            agg.update(df)
+        agg.processed[os.path.abspath(path)] = key
+        if state_path:
+            agg.save(state_path)
+
+    return agg.result()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from scripts import cart, profiling
+from scripts.cluster_encoding import ClusterTargetEncoder, N_CLUSTERS
+from scripts.config import FEATURES_CART
+
+TEST_SIZE = 0.2
+METHODS = {
+    "naive": "Benchmark Naïf",
+    "clustered": "Clustering + Target Encoding"
+}
+
+
+def naive_split(fm, seed, features=FEATURES_CART, target="valeur"):
+    """ Jeu d'apprentissage / test du benchmark naïf (variables brutes imputées par la médiane) """
+    X = fm.frame(features)
+    y = fm.target(target)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed)
+    return X_train, X_test, y_train, y_test, False
+
+
+def clustered_split(fm, seed, features=FEATURES_CART, target="valeur", n_clusters=N_CLUSTERS):
+    """
+    Jeu d'apprentissage / test du modèle avec clustering : cible en log, et variable 'cluster_expected'
+    (médiane de la cible du cluster KMeans de la ville, calculée sur le Train uniquement)
+    """
+    X = fm.frame(features)
+    y = pd.Series(fm.target(target))
+    y_log = np.log1p(y)
+
+    # Split (Avant le Target Encoding pour éviter un problème de data leakage)
+    X_train_raw, X_test_raw, y_train_log, _ = train_test_split(X, y_log, test_size=TEST_SIZE, random_state=seed)
+    _, _, _, y_test_real = train_test_split(X, y, test_size=TEST_SIZE, random_state=seed)
+
+    # Clusters construits sur toutes les villes du polluant, médianes de la cible sur le Train
+    encoder = ClusterTargetEncoder(n_clusters=n_clusters, random_state=seed, reference=X)
+    encoder.fit(X_train_raw, y_train_log)
+
+    return encoder.transform(X_train_raw), encoder.transform(X_test_raw), y_train_log, y_test_real, True
+
+
+SPLITS = {"naive": naive_split, "clustered": clustered_split}
+
+
+@profiling.timed()
+def train_all(store, seed, pollutants=None, variants=("naive", "clustered"), n_jobs=-1):
+    """
+    Entraîne en une fois les arbres CART de tous les polluants et de toutes les variantes
+    (store : polluant -> FeatureMatrix, cf. scripts.feature_store), sur un seul pool de workers.
+    Retourne le tableau de résultats des boucles du notebook, trié par R2 décroissant.
+    """
+    pollutants = list(store) if pollutants is None else pollutants
+    datasets = {(pol, v): SPLITS[v](store[pol], seed) for pol in pollutants for v in variants}
+
+    results = cart.perform_cart_gridsearch_many(seed, datasets, n_jobs=n_jobs)
+
+    table = [
+        {
+            "Pollutant": pol,
+            "R2 Score": round(r2, 3),
+            "RMSE": round(rmse, 3),
+            "MAE": round(mae, 3),
+            "Best Depth": best_model.max_depth,
+            "Method": METHODS[v]
+        }
+        for (pol, v), (best_model, _, r2, rmse, mae) in results.items()
+    ]
+    return pd.DataFrame(table).sort_values(by="R2 Score", ascending=False)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts import correlation
+
+
+def _frame(seed=0, n=400, missing=0.2):
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=n)
+    df = pd.DataFrame({
+        "population_2022": np.exp(base + rng.normal(size=n)),
+        "densite_population_2022": base ** 3 + rng.normal(size=n),
+        "nb_hotels_2022": rng.integers(0, 5, n).astype(float),
+        "valeur": base + rng.normal(scale=0.5, size=n),
+        "valeur_brute": rng.normal(size=n),
+    })
+    return df.mask(rng.random(df.shape) < missing)
+
+
+@pytest.mark.parametrize("method", correlation.METHODS)
+@pytest.mark.parametrize("missing", [0.0, 0.2])
+def test_matches_pandas(method, missing):
+    df = _frame(missing=missing)
+    expected = df.corr(method=method)
+    result = correlation.correlation_matrix(df, method=method)
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=1e-6)
+
+
+@pytest.mark.parametrize("method", correlation.METHODS)
+def test_chunk_does_not_change_result(method):
+    df = _frame(seed=1)
+    full = correlation.correlation_matrix(df, method=method)
+    correlation._CORR.clear()
+    chunked = correlation.correlation_matrix(df, method=method, chunk=2)
+    np.testing.assert_allclose(chunked.to_numpy(), full.to_numpy(), atol=1e-6)
+
+
+def test_cache_is_bounded():
+    correlation._CORR.clear()
+    for seed in range(correlation.CACHE_SIZE + 5):
+        correlation.correlation_matrix(_frame(seed=seed, n=50))
+    assert len(correlation._CORR) <= correlation.CACHE_SIZE